@@ -0,0 +1,200 @@
+#  MIT License
+#
+#  Copyright (c)  2025 Mathieu Imfeld
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#  OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#  SOFTWARE.
+
+"""
+Measures how long it takes to parse HTTPRoute and VirtualService watch events into our models,
+and how much of each event the models keep, when extra fields are dropped as they are now
+versus retained as they used to be.
+
+    python benchmarks/event_parsing.py --events 10000
+"""
+
+import gc
+import json
+import time
+import pickle
+import typing
+import logging
+import argparse
+
+from cloud_provider_mdns import base
+from cloud_provider_mdns.base import HTTPRoute, VirtualService
+
+
+def metadata(name: str, namespace: str, spec: typing.Dict) -> typing.Dict:
+    """
+    Metadata as the API server returns it for an object applied with kubectl
+    """
+    return {
+        "name": name,
+        "namespace": namespace,
+        "uid": "0b8f0d3c-4c1d-4a8e-9d6e-3f1c2b7a9e51",
+        "resourceVersion": "1234567",
+        "generation": 3,
+        "creationTimestamp": "2025-01-01T00:00:00Z",
+        "labels": {
+            "app.kubernetes.io/name": name,
+            "app.kubernetes.io/part-of": "bench",
+        },
+        "annotations": {
+            "kubectl.kubernetes.io/last-applied-configuration": json.dumps(
+                {"metadata": {"name": name, "namespace": namespace}, "spec": spec}
+            )
+        },
+        "managedFields": [
+            {
+                "manager": manager,
+                "operation": "Update",
+                "apiVersion": "v1",
+                "time": "2025-01-01T00:00:00Z",
+                "fieldsType": "FieldsV1",
+                "fieldsV1": {
+                    f"f:{key}": {f"f:{i}": {} for i in range(10)}
+                    for key in ["metadata", "spec", "status"]
+                },
+            }
+            for manager in ["kubectl-client-side-apply", "gateway-controller"]
+        ],
+    }
+
+
+def httproute_event(i: int) -> typing.Dict:
+    spec = {
+        "parentRefs": [{"name": "gw", "namespace": "edge", "sectionName": "https"}],
+        "hostnames": [f"app{i}.local"],
+        "rules": [
+            {
+                "matches": [{"path": {"type": "PathPrefix", "value": f"/api/v{v}"}}],
+                "filters": [
+                    {
+                        "type": "RequestHeaderModifier",
+                        "requestHeaderModifier": {
+                            "add": [{"name": "X-Bench", "value": "1"}]
+                        },
+                    }
+                ],
+                "backendRefs": [{"name": f"app{i}", "port": 8080, "weight": 1}],
+            }
+            for v in range(5)
+        ],
+    }
+    return {
+        "apiVersion": "gateway.networking.k8s.io/v1",
+        "kind": "HTTPRoute",
+        "metadata": metadata(f"app{i}", "bench", spec),
+        "spec": spec,
+        "status": {
+            "parents": [
+                {
+                    "parentRef": {
+                        "name": "gw",
+                        "namespace": "edge",
+                        "sectionName": "https",
+                    },
+                    "controllerName": "gateway-controller",
+                    "conditions": [
+                        {
+                            "type": condition,
+                            "status": "True",
+                            "reason": condition,
+                            "message": "Route is accepted",
+                            "observedGeneration": 3,
+                            "lastTransitionTime": "2025-01-01T00:00:00Z",
+                        }
+                        for condition in ["Accepted", "ResolvedRefs"]
+                    ],
+                }
+            ]
+        },
+    }
+
+
+def virtualservice_event(i: int) -> typing.Dict:
+    spec = {
+        "gateways": ["istio-system/ingress"],
+        "hosts": [f"app{i}.local"],
+        "http": [
+            {
+                "match": [{"uri": {"prefix": f"/api/v{v}"}}],
+                "route": [
+                    {"destination": {"host": f"app{i}", "port": {"number": 8080}}}
+                ],
+                "retries": {"attempts": 3, "perTryTimeout": "2s"},
+            }
+            for v in range(5)
+        ],
+    }
+    return {
+        "apiVersion": "networking.istio.io/v1",
+        "kind": "VirtualService",
+        "metadata": metadata(f"app{i}", "bench", spec),
+        "spec": spec,
+    }
+
+
+def retain_extras(extra: str):
+    """
+    Rebuild all our models to either retain ("allow") or drop ("ignore") extra fields. They are
+    rebuilt in the order they are defined, so every model embeds the rebuilt models of its fields
+    """
+    for model in base.PydanticIgnoreExtraFields.__subclasses__():
+        model.model_config["extra"] = extra
+        model.model_rebuild(force=True)
+
+
+def measure(
+    model: typing.Type[base.PydanticIgnoreExtraFields], events: typing.List[typing.Dict]
+):
+    gc.disable()
+    try:
+        start = time.perf_counter()
+        parsed = [model.model_validate(event) for event in events]
+        elapsed = time.perf_counter() - start
+    finally:
+        gc.enable()
+    retained = sum(len(pickle.dumps(obj)) for obj in parsed) / len(parsed)
+    return elapsed / len(events) * 1e6, retained
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--events", type=int, default=10000)
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+    workloads = [
+        (HTTPRoute, [httproute_event(i) for i in range(args.events)]),
+        (VirtualService, [virtualservice_event(i) for i in range(args.events)]),
+    ]
+    for model, events in workloads:
+        raw = sum(len(pickle.dumps(event)) for event in events) / len(events)
+        for extra in ["ignore", "allow"]:
+            retain_extras(extra)
+            per_event, retained = measure(model, events)
+            print(
+                f"{model.__name__:>14}, extra={extra:<6}: {per_event:7.1f}µs per event, "
+                f"{retained:8.0f} of {raw:.0f} bytes retained"
+            )
+    retain_extras("ignore")
+
+
+if __name__ == "__main__":
+    main()
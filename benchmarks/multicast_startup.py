@@ -0,0 +1,117 @@
+#  MIT License
+#
+#  Copyright (c)  2025 Mathieu Imfeld
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#  OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#  SOFTWARE.
+
+"""
+Measures the time it takes until all services are announced in multicast DNS when the
+registry starts up with a number of .local names, for varying registration concurrency.
+
+By default zeroconf is simulated with a fixed delay per registration standing in for its
+probing and announcing. Pass --real to register on your actual network interfaces instead.
+
+    python benchmarks/multicast_startup.py --records 100 --concurrency 1 8 32
+"""
+
+import time
+import asyncio
+import logging
+import argparse
+
+import zeroconf.asyncio
+
+from cloud_provider_mdns.base import Record
+from cloud_provider_mdns.registry import Registry
+from cloud_provider_mdns.nameservers import MulticastNameserver
+
+
+class SimulatedAsyncZeroconf:
+    """
+    Takes a fixed amount of time for every registration, as zeroconf does while probing
+    """
+
+    delay = 0.75
+
+    def __init__(self, *args, **kwargs) -> None:
+        pass
+
+    async def async_register_service(self, info, *args, **kwargs):
+        await asyncio.sleep(self.delay)
+
+    async def async_update_service(self, info):
+        pass
+
+    async def async_unregister_service(self, info):
+        pass
+
+    async def async_unregister_all_services(self):
+        pass
+
+    async def async_close(self):
+        pass
+
+
+async def time_to_all_announced(records: int, concurrency: int) -> float:
+    registry = Registry(notify_window=3600)
+    ns = MulticastNameserver(registry, max_concurrency=concurrency)
+    try:
+        for i in range(records):
+            await registry.add_record(
+                Record(
+                    owner_id=f"bench/app{i}",
+                    hostname=f"bench-app{i}.local",
+                    ip_address=f"127.0.{i // 250}.{i % 250 + 1}",
+                )
+            )
+        start = time.perf_counter()
+        await registry.flush()
+        elapsed = time.perf_counter() - start
+        assert len(ns.registered()) == records
+        return elapsed
+    finally:
+        await ns.shutdown()
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--records", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32, 128])
+    parser.add_argument(
+        "--delay",
+        type=float,
+        default=SimulatedAsyncZeroconf.delay,
+        help="Simulated seconds per registration",
+    )
+    parser.add_argument("--real", action="store_true", help="Use real zeroconf")
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+    if not args.real:
+        SimulatedAsyncZeroconf.delay = args.delay
+        zeroconf.asyncio.AsyncZeroconf = SimulatedAsyncZeroconf
+    for concurrency in args.concurrency:
+        elapsed = await time_to_all_announced(args.records, concurrency)
+        print(
+            f"{args.records} records, concurrency {concurrency:>4}: "
+            f"all announced after {elapsed:8.3f}s"
+        )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,124 @@
+#  MIT License
+#
+#  Copyright (c)  2025 Mathieu Imfeld
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#  OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#  SOFTWARE.
+
+"""
+Measures what it costs to create, hash, compare and derive the names of a large number of
+records, comparing the slotted Record to the plain frozen dataclass it replaced.
+
+    python benchmarks/record_table.py --records 100000
+"""
+
+import gc
+import time
+import typing
+import argparse
+import dataclasses
+import tracemalloc
+
+from cloud_provider_mdns.base import Record
+
+
+@dataclasses.dataclass(frozen=True)
+class PlainRecord:
+    """
+    The Record as it used to be, deriving its names on every access
+    """
+
+    owner_id: str
+    hostname: str
+    ip_address: str
+    gateway_id: str = dataclasses.field(default="0.0.0.0")
+    port: int = dataclasses.field(default=80)
+
+    @property
+    def unqualified(self):
+        return self.hostname.replace(f".{self.domain}", "")
+
+    @property
+    def fqdn(self) -> str:
+        if self.hostname.endswith("."):
+            return self.hostname
+        return f"{self.hostname}."
+
+    @property
+    def domain(self) -> str:
+        return self.hostname.split(".")[-1]
+
+
+def timed(func: typing.Callable[[], typing.Any]) -> float:
+    gc.disable()
+    try:
+        start = time.perf_counter()
+        func()
+        return time.perf_counter() - start
+    finally:
+        gc.enable()
+
+
+def measure(record_class: typing.Type, count: int) -> typing.Dict[str, float]:
+    args = [
+        (
+            f"bench/app{i}",
+            f"app{i}.local" if i % 2 == 0 else f"app{i}.k8s",
+            f"10.{i // 65536}.{i // 256 % 256}.{i % 256}",
+            "edge/gw",
+            443,
+        )
+        for i in range(count)
+    ]
+    tracemalloc.start()
+    records = [record_class(*arg) for arg in args]
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    copies = [record_class(*arg) for arg in args]
+    published = set(records)
+    return {
+        "create": timed(lambda: [record_class(*arg) for arg in args]),
+        "hash into set": timed(lambda: set(records)),
+        "compare": timed(lambda: [copy in published for copy in copies]),
+        "diff": timed(lambda: published - set(copies[: count // 2])),
+        "fqdn": timed(lambda: [record.fqdn for record in records]),
+        "domain": timed(lambda: [r for r in records if r.fqdn.endswith("local.")]),
+        "unqualified": timed(lambda: [record.unqualified for record in records]),
+        "MB": size / 1024 / 1024,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--records", type=int, default=100000)
+    args = parser.parse_args()
+    results = {
+        cls.__name__: measure(cls, args.records) for cls in [PlainRecord, Record]
+    }
+    print(f"{args.records} records {'':>8}" + "".join(f"{n:>14}" for n in results))
+    for metric in results["Record"]:
+        unit = "MB" if metric == "MB" else "ms"
+        scale = 1 if metric == "MB" else 1000
+        print(
+            f"{metric:>15} ({unit})"
+            + "".join(f"{r[metric] * scale:14.1f}" for r in results.values())
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -21,6 +21,8 @@
 #  SOFTWARE.
 
 import abc
+import time
+import random
 import asyncio
 import typing
 import dataclasses
@@ -32,10 +34,12 @@ import pydantic
 
 class PydanticIgnoreExtraFields(pydantic.BaseModel):
     """
-    A base class for Pydantic models that ignores extra fields
+    A base class for Pydantic models that ignores extra fields. We only need a few fields of the
+    resources we watch, so we drop the rest (such as managedFields, annotations and the rules of
+    a HTTPRoute) rather than copying and keeping it for every resource
     """
 
-    model_config = pydantic.ConfigDict(extra="allow")
+    model_config = pydantic.ConfigDict(extra="ignore")
 
 
 class ObjectMeta(PydanticIgnoreExtraFields):
@@ -45,6 +49,7 @@ class ObjectMeta(PydanticIgnoreExtraFields):
 
     name: str
     namespace: str
+    resourceVersion: str | None = None
 
 
 class ParentReference(PydanticIgnoreExtraFields):
@@ -107,7 +112,7 @@ class HTTPRoute(PydanticIgnoreExtraFields):
     kind: str = pydantic.Field(default="HTTPRoute")
     metadata: ObjectMeta
     spec: HTTPRouteSpec
-    status: HTTPRouteStatus
+    status: HTTPRouteStatus = pydantic.Field(default_factory=HTTPRouteStatus)
 
     def accepted(self) -> bool:
         if len(self.status.parents) == 0:
@@ -184,7 +189,9 @@ class KubernetesGateway(PydanticIgnoreExtraFields):
     kind: str = pydantic.Field(default="Gateway")
     metadata: ObjectMeta
     spec: KubernetesGatewaySpec
-    status: KubernetesGatewayStatus
+    status: KubernetesGatewayStatus = pydantic.Field(
+        default_factory=KubernetesGatewayStatus
+    )
 
     def addresses(self) -> typing.List[str]:
         """
@@ -254,10 +261,12 @@ class NativeIstioGateway(PydanticIgnoreExtraFields):
     spec: NativeIstioGatewaySpec
 
 
-@dataclasses.dataclass(frozen=True)
+@dataclasses.dataclass(frozen=True, slots=True)
 class Record:
     """
-    A record we maintain in multicast and/or unicast DNS
+    A record we maintain in multicast and/or unicast DNS. There is one for every name and
+    address we publish, so it only holds its fields in slots and derives its names from the
+    hostname when asked
     """
 
     owner_id: str
@@ -267,27 +276,115 @@ class Record:
     port: int = dataclasses.field(default=80)
 
     @property
-    def unqualified(self):
+    def fqdn(self) -> str:
+        hostname = self.hostname
+        return hostname if hostname.endswith(".") else f"{hostname}."
+
+    @property
+    def domain(self) -> str:
+        return self.hostname.rpartition(".")[2]
+
+    @property
+    def unqualified(self) -> str:
+        return self.hostname.replace(f".{self.domain}", "")
+
+
+class ChangeSet:
+    """
+    The net changes to the records in the registry since the change set was created.
+    Adding a record that was removed within the same change set (or vice versa) cancels out,
+    records removed and added for the same owner and hostname are reported as modified
+    """
+
+    def __init__(self) -> None:
+        self._added: typing.Set[Record] = set()
+        self._removed: typing.Set[Record] = set()
+        self._partitioned: (
+            typing.Tuple[
+                typing.Set[Record],
+                typing.Set[Record],
+                typing.List[typing.Tuple[Record, Record]],
+            ]
+            | None
+        ) = None
+
+    def add(self, record: Record):
+        self._partitioned = None
+        if record in self._removed:
+            self._removed.remove(record)
+        else:
+            self._added.add(record)
+
+    def remove(self, record: Record):
+        self._partitioned = None
+        if record in self._added:
+            self._added.remove(record)
+        else:
+            self._removed.add(record)
+
+    def merge(self, other: "ChangeSet"):
         """
-        Return the unqualified hostname without its domain
+        Merge the changes of a later change set into this one
         """
-        return self.hostname.replace(f".{self.domain}", "")
+        for record in other._removed:
+            self.remove(record)
+        for record in other._added:
+            self.add(record)
 
     @property
-    def fqdn(self) -> str:
+    def added(self) -> typing.Set[Record]:
         """
-        The fully qualified domain name
+        Records that were added and do not replace a removed record
         """
-        if self.hostname.endswith("."):
-            return self.hostname
-        return f"{self.hostname}."
+        return self._partition()[0]
 
     @property
-    def domain(self) -> str:
+    def removed(self) -> typing.Set[Record]:
         """
-        The domain of the record
+        Records that were removed and are not replaced by an added record
         """
-        return self.hostname.split(".")[-1]
+        return self._partition()[1]
+
+    @property
+    def modified(self) -> typing.List[typing.Tuple[Record, Record]]:
+        """
+        Pairs of the current and the replacing record for the same owner and hostname
+        """
+        return self._partition()[2]
+
+    def _partition(
+        self,
+    ) -> typing.Tuple[
+        typing.Set[Record],
+        typing.Set[Record],
+        typing.List[typing.Tuple[Record, Record]],
+    ]:
+        if self._partitioned is not None:
+            return self._partitioned
+        removed_by_key: typing.Dict[typing.Tuple[str, str], typing.List[Record]] = {}
+        for record in self._removed:
+            removed_by_key.setdefault((record.owner_id, record.hostname), []).append(
+                record
+            )
+        added = set()
+        removed = set(self._removed)
+        modified = []
+        for record in self._added:
+            candidates = removed_by_key.get((record.owner_id, record.hostname))
+            if candidates:
+                current = candidates.pop()
+                removed.remove(current)
+                modified.append((current, record))
+            else:
+                added.add(record)
+        self._partitioned = (added, removed, modified)
+        return self._partitioned
+
+    def __len__(self) -> int:
+        return len(self._added) + len(self._removed)
+
+    def __bool__(self) -> bool:
+        return len(self) > 0
 
 
 class BaseTask(abc.ABC):
@@ -295,10 +392,14 @@ class BaseTask(abc.ABC):
     A re-usable abstract base class for tasks
     """
 
+    backoff_min: float = 1
+    backoff_max: float = 60
+
     def __init__(self, *args, **kwargs):
         self._logger = logging.getLogger(self.__class__.__name__)
         self._task = None
         self._should_stop = False
+        self.restarts = 0
 
     def start(self):
         """
@@ -320,6 +421,47 @@ class BaseTask(abc.ABC):
         """
         pass
 
+    def status(self) -> typing.Dict[str, typing.Any]:
+        """
+        Return the health of the task for logging and monitoring
+        """
+        return {"restarts": self.restarts}
+
+    def describe_status(self) -> str:
+        return ", ".join(
+            f"{key}={value:.1f}" if isinstance(value, float) else f"{key}={value}"
+            for key, value in self.status().items()
+        )
+
+    async def _supervise(self, func: typing.Callable[[], typing.Awaitable[None]]):
+        """
+        Run func until the task is asked to stop, restarting it whenever it returns or fails.
+        Failures are retried with jittered exponential backoff, which is reset once func has
+        been running for longer than the maximum backoff
+        """
+        backoff = self.backoff_min
+        while not self._should_stop:
+            started = time.monotonic()
+            try:
+                await func()
+                backoff = self.backoff_min
+                continue
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.restarts += 1
+                if time.monotonic() - started > self.backoff_max:
+                    backoff = self.backoff_min
+                delay = random.uniform(backoff / 2, backoff)
+                self._logger.warning(
+                    "%s: %s, restarting",
+                    e.__class__.__name__,
+                    e,
+                    extra={"status": f"in {delay:.1f}s, {self.describe_status()}"},
+                )
+                await asyncio.sleep(delay)
+                backoff = min(backoff * 2, self.backoff_max)
+
 
 class CPMException(Exception):
     """
@@ -364,24 +506,74 @@ class GatewayNotReadyException(CPMException):
 
 class BaseNameserver:
     """
-    Common Nameserver implementation
+    Common Nameserver implementation. A nameserver with a zone is only handed the records
+    within that zone by the registry, one without a zone all of them
     """
 
-    def __init__(self, registry: "Registry", *args, **kwargs) -> None:
+    zone: str | None = None
+    snapshot_key: str | None = None
+
+    def __init__(self, registry: "Registry", **kwargs) -> None:
         self._logger = logging.getLogger(self.__class__.__name__)
+        self.zone = kwargs.get("zone", self.zone)
         self._registry = registry
         self._registry.subscribe(self)
 
     async def shutdown(self):
         pass
 
+    def status(self) -> typing.Dict[str, typing.Any]:
+        """
+        Return the counters of this nameserver for monitoring
+        """
+        return {}
+
+    def registered(self) -> typing.Set[Record]:
+        """
+        Return the records currently published by this nameserver
+        """
+        return set()
+
+    def restore(self, records: typing.Set[Record]):
+        """
+        Take the records restored from a snapshot as published. Only nameservers with a
+        snapshot_key are snapshotted, those that must publish anew in every process are not
+        """
+        raise NotImplementedError()
+
+    async def withdraw(self):
+        """
+        Stop publishing the records, such as when another replica takes over publishing them
+        """
+        raise NotImplementedError()
+
     async def update(self, records: typing.Set[Record]):
-        pass
+        """
+        Reconcile the published records with the full set of records in our zone
+        """
+        registered = self.registered()
+        for rec in registered.difference(records):
+            await self.remove(rec)
+        for rec in registered.intersection(records):
+            await self.modify(rec, rec)
+        for rec in records.difference(registered):
+            await self.add(rec)
+
+    async def apply(self, changes: ChangeSet):
+        """
+        Publish the changes made to the records in our zone
+        """
+        for rec in changes.removed:
+            await self.remove(rec)
+        for current, rec in changes.modified:
+            await self.modify(current, rec)
+        for rec in changes.added:
+            await self.add(rec)
 
     async def add(self, rec: Record):
         raise NotImplementedError()
 
-    async def modify(self, rec: Record):
+    async def modify(self, current: Record, rec: Record):
         raise NotImplementedError()
 
     async def remove(self, rec: Record):
@@ -389,27 +581,288 @@ class BaseNameserver:
 
 
 class BaseWatcher(BaseTask):
-    def __init__(self, registry: "Registry") -> None:
+    """
+    Supervises a list and watch of a kind of Kubernetes resource and hands its events to
+    handle(). Events are queued to a number of workers, sharded by the resource they concern,
+    so that a slow event does not hold up those of other resources while the events of any
+    one resource are still handled in order. A failure to handle an event is logged without
+    interrupting the stream, while a failing stream is restarted with backoff
+    """
+
+    kind: str = "resources"
+    required_api_name: str | None = None
+
+    def __init__(self, registry: "Registry", **kwargs) -> None:
         super().__init__()
         self._registry = registry
         self._watch = kubernetes.watch.Watch()
+        self._resource_version: str | None = None
+        self.last_event: float | None = None
+        self.events: typing.Dict[str, int] = {}
+        self.failed_events = 0
+        self.processing_lag = 0.0
+        self.synced = asyncio.Event()
+        self._owners: typing.Set[str] = set()
+        self._namespace: str | None = kwargs.get("namespace")
+        self._exclude_namespaces: typing.List[str] = kwargs.get(
+            "exclude_namespaces", []
+        )
+        self._label_selector: str = kwargs.get("label_selector", "")
+        self.metric_labels = {
+            "watcher": self.__class__.__name__,
+            "namespace": self._namespace or "",
+        }
+        self._queues: typing.List[
+            asyncio.Queue[typing.Tuple[float, typing.Dict[str, typing.Any]]]
+        ] = [
+            asyncio.Queue(maxsize=kwargs.get("queue_size", 1000))
+            for _ in range(max(1, kwargs.get("workers", 1)))
+        ]
 
     async def run(self):
+        try:
+            async with asyncio.TaskGroup() as tg:
+                workers = [tg.create_task(self._work(queue)) for queue in self._queues]
+                await self._supervise(self._watch_events)
+                await self._drain()
+                for worker in workers:
+                    worker.cancel()
+        except asyncio.CancelledError:
+            self._logger.info("Stopping")
+            self._should_stop = True
+            await self._watch.close()
+            raise
+
+    def list_call(
+        self,
+    ) -> typing.Tuple[typing.Callable, typing.Tuple, typing.Dict[str, typing.Any]]:
+        """
+        Return the API function listing the resources along with its arguments
+        """
         raise NotImplementedError
 
-    async def register_record(self, op: str, record: Record):
-        match op:
-            case "ADDED":
-                await self._registry.add_record(record)
-                self._logger.info(f"Record {record.owner_id} adds {record.hostname}")
-            case "MODIFIED":
-                await self._registry.modify_record(record)
-                self._logger.info(
-                    f"Record {record.owner_id} modifies {record.hostname}"
+    def selectors(self, field_selector: str = "") -> typing.Dict[str, str]:
+        """
+        Return the label and field selectors for the list call, so the API server filters out
+        the resources we are not interested in rather than us
+        """
+        fields = [field_selector] if field_selector != "" else []
+        fields.extend(
+            f"metadata.namespace!={namespace}" for namespace in self._exclude_namespaces
+        )
+        selectors = {}
+        if len(fields) > 0:
+            selectors["field_selector"] = ",".join(fields)
+        if self._label_selector != "":
+            selectors["label_selector"] = self._label_selector
+        return selectors
+
+    def describe_scope(self) -> str:
+        scope = self.kind
+        if self._namespace is not None:
+            scope += f" in namespace {self._namespace}"
+        if self._label_selector != "":
+            scope += f" labelled {self._label_selector}"
+        return scope
+
+    def _list_custom_objects(
+        self, group: str, version: str, plural: str
+    ) -> typing.Tuple[typing.Callable, typing.Tuple, typing.Dict[str, typing.Any]]:
+        """
+        Return the list call for custom objects, either across the cluster or in our namespace
+        """
+        if self._namespace is None:
+            return (
+                self._api.list_cluster_custom_object,
+                (group, version, plural),
+                self.selectors(),
+            )
+        return (
+            self._api.list_namespaced_custom_object,
+            (group, version, self._namespace, plural),
+            self.selectors(),
+        )
+
+    async def handle(self, event_type: str, obj: typing.Any):
+        """
+        Handle an ADDED, MODIFIED or DELETED event for a resource
+        """
+        raise NotImplementedError
+
+    @staticmethod
+    async def wait_synced(watchers: typing.Iterable["BaseWatcher"]):
+        """
+        Wait for every watcher to have handled its first list. Until then, the registry lacks
+        the resources not listed yet and reconciling with it removes their records
+        """
+        await asyncio.gather(*(watcher.synced.wait() for watcher in watchers))
+
+    async def sweep(self, seen: typing.Set[str]):
+        """
+        Drop whatever was registered for resources that are missing from a fresh list, because
+        they were deleted while we were not watching. By default, these are the owners of the
+        records registered through register_records()
+        """
+        await self._registry.remove_owners(self._owners - seen)
+        self._owners &= seen
+
+    @property
+    def seconds_since_last_event(self) -> float | None:
+        if self.last_event is None:
+            return None
+        return time.monotonic() - self.last_event
+
+    @property
+    def queue_depth(self) -> int:
+        return sum(queue.qsize() for queue in self._queues)
+
+    def status(self) -> typing.Dict[str, typing.Any]:
+        return {
+            **super().status(),
+            "failed_events": self.failed_events,
+            "seconds_since_last_event": self.seconds_since_last_event,
+            "queue_depth": self.queue_depth,
+            "processing_lag": self.processing_lag,
+        }
+
+    async def _watch_events(self):
+        # Checking for the API is part of the supervised stream, so failing to reach the API
+        # server is retried rather than ending the watcher
+        if self.required_api_name is not None and not await self._has_api(
+            required_api_name=self.required_api_name
+        ):
+            self._logger.warning(
+                "Not watching for %s because the cluster you are connected to does not know %s",
+                self.kind,
+                self.required_api_name,
+            )
+            self._should_stop = True
+            self.synced.set()
+            return
+        self._logger.info("Watching for %s", self.describe_scope())
+        func, args, kwargs = self.list_call()
+        async for event in self._stream(func, *args, **kwargs):
+            self.last_event = time.monotonic()
+            self.events[event["type"]] = self.events.get(event["type"], 0) + 1
+            queue = self._queues[
+                hash(self._resource_id(event["object"])) % len(self._queues)
+            ]
+            # Waiting for room in the queue holds up the stream rather than buffering without bounds
+            await queue.put((self.last_event, event))
+
+    async def _work(
+        self, queue: asyncio.Queue[typing.Tuple[float, typing.Dict[str, typing.Any]]]
+    ):
+        while True:
+            queued, event = await queue.get()
+            self.processing_lag = time.monotonic() - queued
+            try:
+                await self.handle(event["type"], event["object"])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.failed_events += 1
+                self._logger.warning(
+                    "Failed to handle %s event: %s: %s",
+                    event["type"],
+                    e.__class__.__name__,
+                    e,
+                    extra={"status": self.describe_status()},
+                )
+            finally:
+                queue.task_done()
+
+    async def _drain(self):
+        """
+        Wait for the workers to have handled every queued event
+        """
+        await asyncio.gather(*(queue.join() for queue in self._queues))
+
+    async def _stream(
+        self, func: typing.Callable, *args, **kwargs
+    ) -> typing.AsyncIterator[typing.Dict[str, typing.Any]]:
+        """
+        Stream the events for the resources listed by func. The resources are listed once
+        and replayed as ADDED events, after which we watch from the resourceVersion of the
+        list. Reconnecting resumes from the last resourceVersion we have seen, including those
+        of bookmarks. Only when the API server no longer knows that resourceVersion (410 Gone)
+        do we return, so the caller streams again from a fresh list.
+        """
+        if self._resource_version is None:
+            self._logger.info("Listing all resources")
+            items, self._resource_version = self._list_items(
+                await func(*args, **kwargs)
+            )
+            for item in items:
+                yield {"type": "ADDED", "object": item}
+            await self._drain()
+            try:
+                await self.sweep({self._resource_id(item) for item in items})
+            except Exception as e:
+                self.failed_events += 1
+                self._logger.warning(
+                    "Failed to sweep %s missing from the list: %s: %s",
+                    self.kind,
+                    e.__class__.__name__,
+                    e,
+                    extra={"status": self.describe_status()},
                 )
+            self.synced.set()
+        try:
+            async for event in self._watch.stream(
+                func,
+                *args,
+                resource_version=self._resource_version,
+                allow_watch_bookmarks=True,
+                **kwargs,
+            ):
+                self._resource_version = self._watch.resource_version
+                if event["type"] == "BOOKMARK":
+                    continue
+                yield event
+        except kubernetes.client.exceptions.ApiException as ae:
+            if ae.status != 410:
+                raise
+            self._logger.info(
+                "Resource version %s is gone, relisting", self._resource_version
+            )
+            self._resource_version = None
+
+    @staticmethod
+    def _list_items(
+        resources: typing.Any,
+    ) -> typing.Tuple[typing.List[typing.Any], str | None]:
+        """
+        Return the items and resourceVersion of a list, be it a custom object list or a model
+        """
+        if isinstance(resources, dict):
+            return (
+                resources.get("items", []),
+                resources.get("metadata", {}).get("resourceVersion"),
+            )
+        return resources.items or [], resources.metadata.resource_version
+
+    @staticmethod
+    def _resource_id(item: typing.Any) -> str:
+        """
+        Return the namespace/name of a listed item, be it a custom object or a model
+        """
+        if isinstance(item, dict):
+            return f"{item['metadata'].get('namespace')}/{item['metadata']['name']}"
+        return f"{item.metadata.namespace}/{item.metadata.name}"
+
+    async def register_records(
+        self, op: str, owner_id: str, records: typing.Set[Record]
+    ):
+        """
+        Register all records of an owner at once, such as one for each of its addresses
+        """
+        match op:
+            case "ADDED" | "MODIFIED":
+                self._owners.add(owner_id)
+                await self._registry.replace_records(owner_id, records)
             case "DELETED":
-                await self._registry.remove_record(record)
-                self._logger.info(f"Record {record.owner_id} removes {record.hostname}")
+                await self._registry.replace_records(owner_id, set())
 
     @staticmethod
     async def _has_api(required_api_name: str) -> bool:
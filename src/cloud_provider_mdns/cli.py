@@ -21,6 +21,8 @@
 #  SOFTWARE.
 
 import sys
+import socket
+import typing
 import pathlib
 import asyncio
 
@@ -30,11 +32,18 @@ import pydantic_settings
 import kubernetes_asyncio as kubernetes  # type: ignore[import-untyped]
 from pydantic_settings import BaseSettings, PydanticBaseSettingsSource
 
-from cloud_provider_mdns import console
-from cloud_provider_mdns.registry import Registry
+from cloud_provider_mdns import console, logs
+from cloud_provider_mdns.election import LeaderElector
+from cloud_provider_mdns.metrics import MetricsServer
+from cloud_provider_mdns.registry import Registry, RegistryReconciler
+from cloud_provider_mdns.snapshot import Snapshotter
 from cloud_provider_mdns.watchers import (
     IngressWatcher,
+    GatewayWatcher,
     HTTPRouteWatcher,
+    IstioCache,
+    IstioGatewayWatcher,
+    LoadBalancerServiceWatcher,
     VirtualServiceWatcher,
 )
 from cloud_provider_mdns.nameservers import (
@@ -54,6 +63,10 @@ class Settings(pydantic_settings.BaseSettings):
     multicast_enable: pydantic_settings.CliImplicitFlag[bool] = pydantic.Field(
         default=True, description="Enable multicast DNS updates"
     )
+    multicast_max_concurrency: int = pydantic.Field(
+        default=32,
+        description="Maximum number of multicast DNS services to register concurrently",
+    )
     unicast_enable: pydantic_settings.CliImplicitFlag[bool] = pydantic.Field(
         default=False, description="Enable unicast DNS updates"
     )
@@ -69,6 +82,91 @@ class Settings(pydantic_settings.BaseSettings):
     unicast_key_secret: str = pydantic.Field(
         default="", description="The TSIG key secret"
     )
+    unicast_max_in_flight: int = pydantic.Field(
+        default=4,
+        description="Maximum number of concurrent DNS UPDATE messages in flight to the unicast DNS server",
+    )
+    unicast_batch_size: int = pydantic.Field(
+        default=100,
+        description="Maximum number of changes to send within a single DNS UPDATE message",
+    )
+    unicast_batch_max_bytes: int = pydantic.Field(
+        default=16384,
+        description="Maximum approximate size in bytes of a single DNS UPDATE message",
+    )
+    watch_workers: int = pydantic.Field(
+        default=4,
+        description="Number of workers handling the events of each watcher, sharded by resource",
+    )
+    watch_queue_size: int = pydantic.Field(
+        default=1000,
+        description="Maximum number of events queued for each worker before the watch is held up",
+    )
+    watch_namespaces: typing.List[str] = pydantic.Field(
+        default_factory=list,
+        description="Only publish the Ingresses, HTTPRoutes and VirtualServices within these namespaces, watching each of them separately. All namespaces when empty",
+    )
+    watch_exclude_namespaces: typing.List[str] = pydantic.Field(
+        default_factory=list,
+        description="Do not publish the Ingresses, HTTPRoutes and VirtualServices within these namespaces",
+    )
+    watch_label_selector: str = pydantic.Field(
+        default="",
+        description="Only publish the Ingresses, HTTPRoutes and VirtualServices matching this label selector",
+    )
+    notify_window: int = pydantic.Field(
+        default=100,
+        description="Milliseconds during which registry changes are coalesced before nameservers are updated, 0 to disable",
+    )
+    notify_max_changes: int = pydantic.Field(
+        default=500,
+        description="Update the nameservers early once this many changes are pending, 0 for no limit",
+    )
+    reconcile_interval: int = pydantic.Field(
+        default=300,
+        description="Seconds between full reconciliations of the nameservers with the registry, 0 to disable",
+    )
+    log_json: pydantic_settings.CliImplicitFlag[bool] = pydantic.Field(
+        default=False, description="Log JSON lines rather than console output"
+    )
+    log_rate_limit: float = pydantic.Field(
+        default=60,
+        description="Seconds during which a repeated warning is logged only once, 0 to disable",
+    )
+    snapshot_file: str = pydantic.Field(
+        default="",
+        description="File to snapshot the records published in unicast DNS to, so a restart only publishes what changed. Disabled when empty",
+    )
+    snapshot_interval: int = pydantic.Field(
+        default=60, description="Seconds between writing snapshots"
+    )
+    leader_election_enable: pydantic_settings.CliImplicitFlag[bool] = pydantic.Field(
+        default=False,
+        description="Elect a single replica to publish records through a Lease, the others stand by",
+    )
+    leader_election_namespace: str = pydantic.Field(
+        default="default", description="Namespace of the Lease"
+    )
+    leader_election_name: str = pydantic.Field(
+        default="cloud-provider-mdns", description="Name of the Lease"
+    )
+    leader_election_identity: str = pydantic.Field(
+        default_factory=socket.gethostname,
+        description="Identity of this replica, the hostname by default",
+    )
+    leader_election_lease_duration: int = pydantic.Field(
+        default=15,
+        description="Seconds after which a standby takes over a lease that was not renewed",
+    )
+    metrics_enable: pydantic_settings.CliImplicitFlag[bool] = pydantic.Field(
+        default=False, description="Serve Prometheus metrics on /metrics"
+    )
+    metrics_address: str = pydantic.Field(
+        default="127.0.0.1", description="Address to serve the metrics on"
+    )
+    metrics_port: int = pydantic.Field(
+        default=8000, description="Port to serve the metrics on"
+    )
 
     @classmethod
     def settings_customise_sources(
@@ -96,11 +194,20 @@ class Settings(pydantic_settings.BaseSettings):
 
 async def main() -> int:
     settings = Settings()
+    log_listener = logs.configure(
+        json_logs=settings.log_json, rate_limit=settings.log_rate_limit
+    )
     await kubernetes.config.load_kube_config()
 
-    registry = Registry()
+    registry = Registry(
+        notify_window=settings.notify_window / 1000,
+        notify_max_changes=settings.notify_max_changes,
+        publishing=not settings.leader_election_enable,
+    )
     if settings.multicast_enable:
-        mcast_ns = MulticastNameserver(registry=registry)
+        mcast_ns = MulticastNameserver(
+            registry=registry, max_concurrency=settings.multicast_max_concurrency
+        )
     else:
         mcast_ns = None
     if settings.unicast_enable:
@@ -110,6 +217,9 @@ async def main() -> int:
             domain=settings.unicast_domain,
             key=settings.unicast_key_name,
             secret=settings.unicast_key_secret,
+            max_in_flight=settings.unicast_max_in_flight,
+            batch_size=settings.unicast_batch_size,
+            batch_max_bytes=settings.unicast_batch_max_bytes,
         )
     else:
         ucast_ns = None
@@ -117,14 +227,80 @@ async def main() -> int:
         console.print(
             "[bold yellow]No nameservers are enabled. It will only show discovery[/bold yellow]"
         )
+    snapshotter: Snapshotter | None = None
     try:
-        ingress_watcher = IngressWatcher(registry)
-        httproute_watcher = HTTPRouteWatcher(registry)
-        virtual_service_watcher = VirtualServiceWatcher(registry)
+        watch_args = dict(
+            workers=settings.watch_workers, queue_size=settings.watch_queue_size
+        )
+        # The API server filters the resources we publish records for. Gateways and the
+        # Services exposing them are watched across the cluster, whatever namespace their
+        # routes are in
+        route_watch_args = dict(
+            watch_args,
+            exclude_namespaces=settings.watch_exclude_namespaces,
+            label_selector=settings.watch_label_selector,
+        )
+        namespaces: typing.List[str | None] = [None]
+        if len(settings.watch_namespaces) > 0:
+            namespaces = [
+                namespace
+                for namespace in settings.watch_namespaces
+                if namespace not in settings.watch_exclude_namespaces
+            ]
+        istio_cache = IstioCache()
+        watchers = [
+            GatewayWatcher(registry, **watch_args),
+            IstioGatewayWatcher(registry, istio_cache, **watch_args),
+            LoadBalancerServiceWatcher(registry, istio_cache, **watch_args),
+        ]
+        for namespace in namespaces:
+            watchers.extend(
+                [
+                    IngressWatcher(registry, namespace=namespace, **route_watch_args),
+                    HTTPRouteWatcher(registry, namespace=namespace, **route_watch_args),
+                    VirtualServiceWatcher(
+                        registry, istio_cache, namespace=namespace, **route_watch_args
+                    ),
+                ]
+            )
+        if settings.snapshot_file != "":
+            snapshotter = Snapshotter(
+                registry,
+                [ns for ns in (mcast_ns, ucast_ns) if ns is not None],
+                watchers,
+                path=pathlib.Path(settings.snapshot_file).expanduser(),
+                interval=settings.snapshot_interval,
+            )
+            snapshotter.restore()
         async with asyncio.TaskGroup() as tg:
-            ingress_watcher_task = tg.create_task(ingress_watcher.run())
-            httproute_watcher_task = tg.create_task(httproute_watcher.run())
-            virtual_service_watcher_task = tg.create_task(virtual_service_watcher.run())
+            for watcher in watchers:
+                tg.create_task(watcher.run())
+            if snapshotter is not None:
+                tg.create_task(snapshotter.run())
+            if settings.leader_election_enable:
+                elector = LeaderElector(
+                    registry,
+                    settings.leader_election_identity,
+                    namespace=settings.leader_election_namespace,
+                    name=settings.leader_election_name,
+                    lease_duration=settings.leader_election_lease_duration,
+                    watchers=watchers,
+                )
+                tg.create_task(elector.run())
+            if settings.reconcile_interval > 0:
+                reconciler = RegistryReconciler(
+                    registry, interval=settings.reconcile_interval, watchers=watchers
+                )
+                tg.create_task(reconciler.run())
+            if settings.metrics_enable:
+                metrics_server = MetricsServer(
+                    registry,
+                    watchers,
+                    [ns for ns in (mcast_ns, ucast_ns) if ns is not None],
+                    address=settings.metrics_address,
+                    port=settings.metrics_port,
+                )
+                tg.create_task(metrics_server.run())
         return 0
     except asyncio.CancelledError:
         print("Shut down")
@@ -133,10 +309,16 @@ async def main() -> int:
         print("Keyboard interrupt, shutting down")
         return 0
     finally:
+        if snapshotter is not None:
+            try:
+                snapshotter.save()
+            except OSError as e:
+                console.print(f"[bold red]Failed to write the snapshot: {e}[/bold red]")
         if mcast_ns is not None:
             await mcast_ns.shutdown()
         if ucast_ns is not None:
             await ucast_ns.shutdown()
+        log_listener.stop()
 
 
 def run() -> int:
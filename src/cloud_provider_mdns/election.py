@@ -0,0 +1,188 @@
+#  MIT License
+#
+#  Copyright (c)  2025 Mathieu Imfeld
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#  OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#  SOFTWARE.
+
+
+import time
+import typing
+import asyncio
+import datetime
+
+import aiohttp
+import kubernetes_asyncio as kubernetes  # type: ignore[import-untyped]
+
+from cloud_provider_mdns.base import BaseTask, BaseWatcher
+from cloud_provider_mdns.registry import Registry
+
+
+class LeaderElector(BaseTask):
+    """
+    Elects a single replica to publish records through a Kubernetes Lease. Every replica
+    watches and keeps its registry up to date, but only the leader publishes it. A standby
+    takes over once the lease has not been renewed for its duration, as observed by its own
+    clock, and the leader stops publishing when it fails to renew the lease within the renew
+    deadline. A new leader only publishes once the watchers have listed their resources, so
+    it does not remove the records of resources it has not listed yet. The lease is released
+    when shutting down so a standby takes over right away
+    """
+
+    def __init__(self, registry: Registry, identity: str, **kwargs) -> None:
+        super().__init__()
+        self._registry = registry
+        self._identity = identity
+        self._watchers: typing.Sequence[BaseWatcher] = kwargs.get("watchers", ())
+        self._takeover: asyncio.Task | None = None
+        self._name: str = kwargs.get("name", "cloud-provider-mdns")
+        self._namespace: str = kwargs.get("namespace", "default")
+        self._lease_duration: float = kwargs.get("lease_duration", 15)
+        self._renew_deadline: float = kwargs.get(
+            "renew_deadline", self._lease_duration * 2 / 3
+        )
+        self._retry_period: float = kwargs.get("retry_period", self._lease_duration / 5)
+        self._api = kubernetes.client.CoordinationV1Api()
+        self.leading = False
+        self._renewed = 0.0
+        self._observed: typing.Tuple[str | None, typing.Any] | None = None
+        self._observed_at = 0.0
+
+    async def run(self):
+        self._logger.info(
+            f"Electing the leader of {self._namespace}/{self._name} as {self._identity}"
+        )
+        try:
+            while not self._should_stop:
+                if await self._try_acquire_or_renew():
+                    self._renewed = time.monotonic()
+                    if not self.leading:
+                        self.leading = True
+                        self._logger.info(f"{self._identity} is now leading")
+                        # Waiting for the watchers must not hold up renewing the lease
+                        self._takeover = asyncio.create_task(self._start_publishing())
+                elif (
+                    self.leading
+                    and time.monotonic() - self._renewed > self._renew_deadline
+                ):
+                    self.leading = False
+                    self._logger.warning(
+                        f"{self._identity} failed to renew the lease, standing by"
+                    )
+                    self._cancel_takeover()
+                    await self._registry.stop_publishing()
+                await asyncio.sleep(self._retry_period)
+        except asyncio.CancelledError:
+            self._cancel_takeover()
+            if self.leading:
+                await asyncio.shield(self._release())
+            raise
+
+    async def _start_publishing(self):
+        await BaseWatcher.wait_synced(self._watchers)
+        try:
+            await self._registry.start_publishing()
+        except Exception:
+            # The periodic reconciliation publishes what we failed to publish here
+            self._logger.exception("Failed to publish the records after taking over")
+
+    def _cancel_takeover(self):
+        if self._takeover is not None:
+            self._takeover.cancel()
+            self._takeover = None
+
+    async def _try_acquire_or_renew(self) -> bool:
+        """
+        Acquire or renew the lease, returns true if we hold it
+        """
+        now = datetime.datetime.now(datetime.UTC)
+        try:
+            try:
+                lease = await self._api.read_namespaced_lease(
+                    self._name, self._namespace
+                )
+            except kubernetes.client.exceptions.ApiException as ae:
+                if ae.status != 404:
+                    raise
+                await self._api.create_namespaced_lease(
+                    self._namespace,
+                    kubernetes.client.V1Lease(
+                        metadata=kubernetes.client.V1ObjectMeta(
+                            name=self._name, namespace=self._namespace
+                        ),
+                        spec=kubernetes.client.V1LeaseSpec(
+                            holder_identity=self._identity,
+                            lease_duration_seconds=max(1, round(self._lease_duration)),
+                            acquire_time=now,
+                            renew_time=now,
+                            lease_transitions=0,
+                        ),
+                    ),
+                )
+                return True
+            spec = lease.spec
+            observed = (spec.holder_identity, spec.renew_time)
+            if observed != self._observed:
+                self._observed = observed
+                self._observed_at = time.monotonic()
+            if spec.holder_identity not in (None, "", self._identity) and (
+                time.monotonic() - self._observed_at
+                < (spec.lease_duration_seconds or self._lease_duration)
+            ):
+                return False
+            if spec.holder_identity != self._identity:
+                self._logger.info(
+                    f"{self._identity} takes over the lease from {spec.holder_identity}"
+                )
+                spec.holder_identity = self._identity
+                spec.acquire_time = now
+                spec.lease_transitions = (spec.lease_transitions or 0) + 1
+            spec.renew_time = now
+            spec.lease_duration_seconds = max(1, round(self._lease_duration))
+            # The lease carries its resourceVersion, so the API server rejects our update with
+            # a conflict should another replica have updated it meanwhile
+            await self._api.replace_namespaced_lease(self._name, self._namespace, lease)
+            return True
+        except kubernetes.client.exceptions.ApiException as ae:
+            if ae.status != 409:
+                self._logger.warning(
+                    f"Failed to acquire or renew the lease: {ae.status} {ae.reason}"
+                )
+            return False
+        except (aiohttp.ClientError, TimeoutError) as e:
+            self._logger.warning(f"Failed to acquire or renew the lease: {e}")
+            return False
+
+    async def _release(self):
+        """
+        Give up the lease so a standby need not wait for it to expire
+        """
+        self.leading = False
+        try:
+            lease = await self._api.read_namespaced_lease(self._name, self._namespace)
+            if lease.spec.holder_identity != self._identity:
+                return
+            lease.spec.holder_identity = None
+            await self._api.replace_namespaced_lease(self._name, self._namespace, lease)
+            self._logger.info(f"{self._identity} released the lease")
+        except (
+            kubernetes.client.exceptions.ApiException,
+            aiohttp.ClientError,
+            TimeoutError,
+        ) as e:
+            self._logger.warning(f"Failed to release the lease: {e}")
@@ -0,0 +1,143 @@
+#  MIT License
+#
+#  Copyright (c)  2025 Mathieu Imfeld
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#  OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#  SOFTWARE.
+
+
+import json
+import time
+import queue
+import typing
+import logging
+import collections
+import logging.handlers
+
+import rich.logging
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Lets a repeated warning through once per interval. Repeats are keyed by the logger, the
+    level and the unformatted message along with its arguments, so the same warning about
+    another resource is still logged. The next warning let through reports how many repeats
+    were suppressed. Only the most recently logged max_keys warnings are remembered. Details
+    that differ with every repeat, such as the status of a task, belong in the status extra
+    rather than the arguments so they do not make every repeat unique
+    """
+
+    max_keys: int = 10000
+
+    def __init__(self, interval: float = 60, level: int = logging.WARNING) -> None:
+        super().__init__()
+        self._interval = interval
+        self._level = level
+        self._seen: collections.OrderedDict[typing.Tuple, typing.List[float | int]] = (
+            collections.OrderedDict()
+        )
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if self._interval <= 0 or record.levelno < self._level:
+            return True
+        key = (record.name, record.levelno, str(record.msg), repr(record.args))
+        now = time.monotonic()
+        seen = self._seen.get(key)
+        if seen is not None and now - seen[0] < self._interval:
+            seen[1] += 1
+            return False
+        if seen is None and len(self._seen) >= self.max_keys:
+            self._seen.popitem(last=False)
+        suppressed = int(seen[1]) if seen is not None else 0
+        self._seen[key] = [now, 0]
+        self._seen.move_to_end(key)
+        if suppressed > 0:
+            record.suppressed = suppressed
+            record.msg = f"{record.msg} (suppressed {suppressed} times)"
+        return True
+
+
+class StatusFormatter(logging.Formatter):
+    """
+    Appends the status of the task that logged the record, if any
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        line = super().format(record)
+        if hasattr(record, "status"):
+            line += f" ({record.status})"
+        return line
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Formats a log record as a single line of JSON
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry: typing.Dict[str, typing.Any] = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        if hasattr(record, "status"):
+            entry["status"] = record.status
+        if hasattr(record, "suppressed"):
+            entry["suppressed"] = record.suppressed
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry)
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    Queues log records for a listener thread without formatting them first. The stock
+    QueueHandler formats in the thread that logs, which is the event loop. Our log
+    arguments are immutable, so formatting them later on the listener thread is safe
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+def configure(
+    json_logs: bool = False, rate_limit: float = 60
+) -> logging.handlers.QueueListener:
+    """
+    Log through a queue, so the event loop never waits for a handler to format and write a
+    line, either as rich console output or as JSON lines. Repeated warnings are rate
+    limited before they are queued. Returns the started listener, stop it when shutting down
+    """
+    handler: logging.Handler
+    if json_logs:
+        handler = logging.StreamHandler()
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler = rich.logging.RichHandler(show_time=False, show_path=False)
+        handler.setFormatter(StatusFormatter("[%(name)s] %(message)s"))
+    log_queue: queue.SimpleQueue[logging.LogRecord] = queue.SimpleQueue()
+    queue_handler = DeferredQueueHandler(log_queue)
+    queue_handler.addFilter(RateLimitFilter(interval=rate_limit))
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(queue_handler)
+    listener = logging.handlers.QueueListener(log_queue, handler)
+    listener.start()
+    return listener
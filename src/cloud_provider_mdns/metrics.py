@@ -0,0 +1,348 @@
+#  MIT License
+#
+#  Copyright (c)  2025 Mathieu Imfeld
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#  OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#  SOFTWARE.
+
+
+import time
+import bisect
+import typing
+import asyncio
+import contextlib
+import collections
+
+from cloud_provider_mdns.base import BaseTask, BaseWatcher, BaseNameserver
+
+if typing.TYPE_CHECKING:
+    from cloud_provider_mdns.registry import Registry
+
+Labels = typing.Tuple[typing.Tuple[str, str], ...]
+
+
+def escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class MetricFamily:
+    """
+    The samples of a metric in the Prometheus text exposition format
+    """
+
+    def __init__(self, name: str, kind: str, documentation: str) -> None:
+        self.name = name
+        self.kind = kind
+        self.documentation = documentation
+        self.samples: typing.List[typing.Tuple[str, Labels, float]] = []
+
+    def add(self, value: float, suffix: str = "", **labels: str):
+        self.samples.append((suffix, tuple(labels.items()), value))
+
+    def render(self) -> typing.Iterator[str]:
+        yield f"# HELP {self.name} {escape(self.documentation)}"
+        yield f"# TYPE {self.name} {self.kind}"
+        for suffix, labels, value in self.samples:
+            rendered = ",".join(f'{key}="{escape(str(val))}"' for key, val in labels)
+            yield (
+                f"{self.name}{suffix}{{{rendered}}} {value!r}"
+                if rendered != ""
+                else f"{self.name}{suffix} {value!r}"
+            )
+
+
+class Counter:
+    """
+    A monotonically increasing count, optionally by labels
+    """
+
+    def __init__(
+        self, name: str, documentation: str, labelnames: typing.Sequence[str] = ()
+    ) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: typing.Dict[typing.Tuple[str, ...], float] = (
+            collections.defaultdict(float)
+        )
+
+    def inc(self, amount: float = 1, **labels: str):
+        self._values[tuple(labels[name] for name in self.labelnames)] += amount
+
+    def collect(self) -> MetricFamily:
+        family = MetricFamily(self.name, "counter", self.documentation)
+        for key, value in self._values.items():
+            family.add(value, **dict(zip(self.labelnames, key)))
+        return family
+
+
+class Histogram:
+    """
+    The distribution of observed values within cumulative buckets, optionally by labels.
+    Observing a value is a binary search and a few additions, cheap enough for hot paths
+    """
+
+    buckets: typing.Tuple[float, ...] = (
+        0.001,
+        0.0025,
+        0.005,
+        0.01,
+        0.025,
+        0.05,
+        0.1,
+        0.25,
+        0.5,
+        1,
+        2.5,
+        5,
+        10,
+    )
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: typing.Sequence[str] = (),
+        buckets: typing.Sequence[float] | None = None,
+    ) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        if buckets is not None:
+            self.buckets = tuple(buckets)
+        # The counts of each bucket plus the +Inf bucket, and the sum of the observed values
+        self._values: typing.Dict[
+            typing.Tuple[str, ...], typing.Tuple[typing.List[int], typing.List[float]]
+        ] = {}
+
+    def observe(self, value: float, **labels: str):
+        key = tuple(labels[name] for name in self.labelnames)
+        if key not in self._values:
+            self._values[key] = ([0] * (len(self.buckets) + 1), [0.0])
+        counts, total = self._values[key]
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        total[0] += value
+
+    @contextlib.contextmanager
+    def time(self, **labels: str) -> typing.Iterator[None]:
+        """
+        Observe the duration of the block, whether or not it raises
+        """
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def collect(self) -> MetricFamily:
+        family = MetricFamily(self.name, "histogram", self.documentation)
+        for key, (counts, total) in self._values.items():
+            labels = dict(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                family.add(cumulative, "_bucket", **labels, le=repr(float(bound)))
+            cumulative += counts[-1]
+            family.add(cumulative, "_bucket", **labels, le="+Inf")
+            family.add(total[0], "_sum", **labels)
+            family.add(cumulative, "_count", **labels)
+        return family
+
+
+NOTIFY_SECONDS = Histogram(
+    "cloud_provider_mdns_registry_notify_seconds",
+    "Time taken to hand the changes of a registry mutation to the notification scheduler, "
+    "including their delivery when it is not coalesced",
+)
+NOTIFY_MERGED_EVENTS = Histogram(
+    "cloud_provider_mdns_registry_notify_merged_events",
+    "Registry mutations merged into each change set delivered to the nameservers",
+    buckets=(1, 2, 5, 10, 25, 50, 100, 250, 500, 1000),
+)
+DELIVER_SECONDS = Histogram(
+    "cloud_provider_mdns_registry_deliver_seconds",
+    "Time taken to deliver a consolidated change set to the nameservers",
+)
+MULTICAST_SECONDS = Histogram(
+    "cloud_provider_mdns_multicast_seconds",
+    "Time taken by zeroconf to register, update or unregister a service",
+    ("operation",),
+)
+UNICAST_UPDATE_SECONDS = Histogram(
+    "cloud_provider_mdns_unicast_update_seconds",
+    "Round trip time of a DNS UPDATE message to the unicast nameserver",
+)
+UNICAST_UPDATE_ERRORS = Counter(
+    "cloud_provider_mdns_unicast_update_errors_total",
+    "DNS UPDATE messages that failed, by rcode or by the exception when no response was received",
+    ("rcode",),
+)
+INSTRUMENTS: typing.Tuple[Counter | Histogram, ...] = (
+    NOTIFY_SECONDS,
+    NOTIFY_MERGED_EVENTS,
+    DELIVER_SECONDS,
+    MULTICAST_SECONDS,
+    UNICAST_UPDATE_SECONDS,
+    UNICAST_UPDATE_ERRORS,
+)
+
+
+class MetricsServer(BaseTask):
+    """
+    Serves the metrics of the registry, the watchers and the nameservers on a local /metrics
+    endpoint for Prometheus to scrape. The state of the registry and the watchers is only
+    collected when scraped, so it costs nothing in between
+    """
+
+    def __init__(
+        self,
+        registry: "Registry",
+        watchers: typing.Sequence[BaseWatcher],
+        nameservers: typing.Sequence[BaseNameserver],
+        **kwargs,
+    ) -> None:
+        super().__init__()
+        self._registry = registry
+        self._watchers = watchers
+        self._nameservers = nameservers
+        self._address: str = kwargs.get("address", "127.0.0.1")
+        self.port: int = kwargs.get("port", 8000)
+
+    async def run(self):
+        server = await asyncio.start_server(self._serve, self._address, self.port)
+        self.port = server.sockets[0].getsockname()[1]
+        self._logger.info(
+            f"Serving metrics on http://{self._address}:{self.port}/metrics"
+        )
+        async with server:
+            await server.serve_forever()
+
+    def collect(self) -> typing.List[MetricFamily]:
+        families = [instrument.collect() for instrument in INSTRUMENTS]
+
+        events = MetricFamily(
+            "cloud_provider_mdns_watch_events_total",
+            "counter",
+            "Events received by a watcher, by type",
+        )
+        lag = MetricFamily(
+            "cloud_provider_mdns_watch_lag_seconds",
+            "gauge",
+            "Time the last event handled by a watcher spent queued",
+        )
+        idle = MetricFamily(
+            "cloud_provider_mdns_watch_seconds_since_last_event",
+            "gauge",
+            "Time since a watcher last received an event",
+        )
+        depth = MetricFamily(
+            "cloud_provider_mdns_watch_queue_depth",
+            "gauge",
+            "Events queued for the workers of a watcher",
+        )
+        failed = MetricFamily(
+            "cloud_provider_mdns_watch_failed_events_total",
+            "counter",
+            "Events a watcher failed to handle",
+        )
+        restarts = MetricFamily(
+            "cloud_provider_mdns_watch_restarts_total",
+            "counter",
+            "Restarts of the watch of a watcher",
+        )
+        for watcher in self._watchers:
+            labels = watcher.metric_labels
+            for event_type, count in watcher.events.items():
+                events.add(count, **labels, type=event_type)
+            lag.add(watcher.processing_lag, **labels)
+            if watcher.seconds_since_last_event is not None:
+                idle.add(watcher.seconds_since_last_event, **labels)
+            depth.add(watcher.queue_depth, **labels)
+            failed.add(watcher.failed_events, **labels)
+            restarts.add(watcher.restarts, **labels)
+        families.extend([events, lag, idle, depth, failed, restarts])
+
+        objects = MetricFamily(
+            "cloud_provider_mdns_registry_objects",
+            "gauge",
+            "Objects known to the registry, by kind",
+        )
+        for kind, count in self._registry.sizes().items():
+            objects.add(count, kind=kind)
+        records = MetricFamily(
+            "cloud_provider_mdns_registry_records",
+            "gauge",
+            "Records within the registry, by domain",
+        )
+        for domain, count in sorted(self._registry.domain_sizes().items()):
+            records.add(count, domain=domain)
+        families.extend([objects, records])
+
+        suppressed = MetricFamily(
+            "cloud_provider_mdns_unicast_suppressed_updates_total",
+            "counter",
+            "DNS UPDATEs not sent because the name already had exactly those addresses",
+        )
+        avoided = MetricFamily(
+            "cloud_provider_mdns_multicast_avoided_announcements_total",
+            "counter",
+            "Multicast DNS announcements avoided because the service did not change",
+        )
+        for ns in self._nameservers:
+            status = ns.status()
+            if "suppressed_updates" in status:
+                suppressed.add(status["suppressed_updates"], zone=ns.zone or "")
+            if "avoided_announcements" in status:
+                avoided.add(status["avoided_announcements"], zone=ns.zone or "")
+        families.extend([suppressed, avoided])
+        return families
+
+    def render(self) -> str:
+        return (
+            "\n".join(line for family in self.collect() for line in family.render())
+            + "\n"
+        )
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), timeout=10)
+            method, path, *_ = request.split(b"\r\n", 1)[0].decode("latin-1").split(" ")
+            if method == "GET" and path.split("?", 1)[0] == "/metrics":
+                status, body = "200 OK", self.render().encode("utf-8")
+            else:
+                status, body = "404 Not Found", b"Not Found\n"
+            writer.write(
+                f"HTTP/1.1 {status}\r\n"
+                "Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                "Connection: close\r\n\r\n".encode("latin-1")
+                + body
+            )
+            await writer.drain()
+        except (
+            asyncio.IncompleteReadError,
+            asyncio.LimitOverrunError,
+            TimeoutError,
+            ConnectionError,
+            ValueError,
+        ) as e:
+            self._logger.debug(f"Ignoring a bad metrics request: {e}")
+        finally:
+            writer.close()
+            with contextlib.suppress(ConnectionError):
+                await writer.wait_closed()
@@ -20,7 +20,11 @@
 #  OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 #  SOFTWARE.
 
+import socket
 import typing
+import dataclasses
+import asyncio
+import logging
 import ipaddress
 
 import zeroconf
@@ -28,95 +32,329 @@ import zeroconf.asyncio
 import dns.message
 import dns.update
 import dns.tsigkeyring
-import dns.query
+import dns.asyncquery
+import dns.asyncbackend
 import dns.rcode
 import dns.exception
-import zeroconf.asyncio
+import dns.inet
 
-from cloud_provider_mdns.base import Record, BaseNameserver
+from cloud_provider_mdns import metrics
+from cloud_provider_mdns.base import Record, ChangeSet, BaseNameserver
 from cloud_provider_mdns.registry import Registry
 
 
 class MulticastNameserver(BaseNameserver):
     """
-    Registers names ending in .local in multicast DNS
+    Registers names ending in .local in multicast DNS, as one service per owner of a name with
+    all of its addresses. Services are registered concurrently since each registration waits
+    for zeroconf to probe and announce, but changes to the same service name are applied in
+    order so name conflicts are still detected
     """
 
+    zone = "local."
+
     def __init__(self, registry: Registry, *args, **kwargs) -> None:
         super().__init__(registry, *args, **kwargs)
         self._aiozc = zeroconf.asyncio.AsyncZeroconf(ip_version=zeroconf.IPVersion.All)
-        self._registered: typing.Dict[Record, zeroconf.asyncio.AsyncServiceInfo] = {}
+        self._services: typing.Dict[
+            typing.Tuple[str, str], zeroconf.asyncio.AsyncServiceInfo
+        ] = {}
+        self._records: typing.Dict[typing.Tuple[str, str], typing.Set[Record]] = {}
+        self._pending: typing.List[
+            typing.Tuple[str, typing.Callable[[], typing.Awaitable[None]]]
+        ] = []
+        self._lock = asyncio.Lock()
+        self._concurrency = asyncio.Semaphore(max(1, kwargs.get("max_concurrency", 32)))
+        self.avoided_announcements = 0
 
     async def shutdown(self):
         await self._aiozc.async_unregister_all_services()
         await self._aiozc.async_close()
 
+    def status(self) -> typing.Dict[str, typing.Any]:
+        return {"avoided_announcements": self.avoided_announcements}
+
+    def registered(self) -> typing.Set[Record]:
+        return {rec for records in self._records.values() for rec in records}
+
+    async def withdraw(self):
+        # The names would conflict with those announced by the replica taking over
+        async with self._lock:
+            self._pending.clear()
+            await self._aiozc.async_unregister_all_services()
+            self._services.clear()
+            self._records.clear()
+
     async def update(self, records: typing.Set[Record]):
-        # Filter out records that do not end in .local.
-        local_records = set(filter(lambda r: r.fqdn.endswith(".local."), records))
+        await super().update(records)
+        await self._run_pending()
 
-        # Remove records
-        for rec in set(self._registered.keys()).difference(local_records):
-            await self._aiozc.async_unregister_service(self._registered[rec])
-            del self._registered[rec]
-            self._logger.info(f"{rec.owner_id} - Removed {rec.fqdn}")
+    async def apply(self, changes: ChangeSet):
+        await super().apply(changes)
+        await self._run_pending()
 
-        # Add records
-        for rec in local_records.difference(self._registered):
-            try:
-                svc_fqdn = f"{rec.unqualified}.covenant._http._tcp.local."
-                si = zeroconf.asyncio.AsyncServiceInfo(
-                    "_http._tcp.local.",
-                    svc_fqdn,
-                    port=rec.port,  # Port is required by Apple, apparently
-                    addresses=[ipaddress.ip_address(rec.ip_address).packed],
-                    server=rec.fqdn,
-                )
+    async def remove(self, rec: Record):
+        self._pending.append((self._service_name(rec), lambda: self._remove(rec)))
+
+    async def add(self, rec: Record):
+        self._pending.append((self._service_name(rec), lambda: self._add(rec)))
+
+    async def modify(self, current: Record, rec: Record):
+        self._pending.append(
+            (self._service_name(rec), lambda: self._modify(current, rec))
+        )
+
+    async def _run_pending(self):
+        async with self._lock:
+            pending, self._pending = self._pending, []
+            by_name: typing.Dict[
+                str, typing.List[typing.Callable[[], typing.Awaitable[None]]]
+            ] = {}
+            for name, op in pending:
+                by_name.setdefault(name, []).append(op)
+            await asyncio.gather(*(self._run_in_order(ops) for ops in by_name.values()))
+
+    async def _run_in_order(
+        self, ops: typing.List[typing.Callable[[], typing.Awaitable[None]]]
+    ):
+        async with self._concurrency:
+            for op in ops:
+                await op()
+
+    @staticmethod
+    def _service_name(rec: Record) -> str:
+        return f"{rec.unqualified}.covenant._http._tcp.local."
+
+    @staticmethod
+    def _service_key(rec: Record) -> typing.Tuple[str, str]:
+        return rec.owner_id, rec.fqdn
+
+    async def _remove(self, rec: Record):
+        key = self._service_key(rec)
+        if rec not in self._records.get(key, ()):
+            return
+        self._records[key].discard(rec)
+        if len(self._records[key]) > 0:
+            await self._publish(key)
+            return
+        with metrics.MULTICAST_SECONDS.time(operation="unregister"):
+            await self._aiozc.async_unregister_service(self._services.pop(key))
+        del self._records[key]
+        self._logger.info("%s - Removed %s", rec.owner_id, rec.fqdn)
+
+    async def _add(self, rec: Record):
+        key = self._service_key(rec)
+        if key in self._services:
+            self._records[key].add(rec)
+            await self._publish(key)
+            return
+        try:
+            si = zeroconf.asyncio.AsyncServiceInfo(
+                "_http._tcp.local.",
+                self._service_name(rec),
+                port=rec.port,  # Port is required by Apple, apparently
+                addresses=[ipaddress.ip_address(rec.ip_address).packed],
+                server=rec.fqdn,
+            )
+            with metrics.MULTICAST_SECONDS.time(operation="register"):
                 await self._aiozc.async_register_service(si, allow_name_change=True)
-                self._registered[rec] = si
-                self._logger.info(
-                    f"Added {rec.fqdn} pointing to {rec.ip_address}:{rec.port} for {rec.owner_id}"
-                )
-            except zeroconf.BadTypeInNameException:
-                self._logger.warning(
-                    f"Ignoring {rec.owner_id} because {rec.fqdn} is invalid"
-                )
-            except zeroconf.ServiceNameAlreadyRegistered:
-                self._logger.warning(
-                    f"Ignoring {rec.owner_id} because {rec.fqdn} is already registered"
-                )
+            self._services[key] = si
+            self._records[key] = {rec}
+            self._logger.info(
+                "Added %s pointing to %s:%d for %s",
+                rec.fqdn,
+                rec.ip_address,
+                rec.port,
+                rec.owner_id,
+            )
+        except zeroconf.BadTypeInNameException:
+            self._logger.warning(
+                "Ignoring %s because %s is invalid", rec.owner_id, rec.fqdn
+            )
+        except zeroconf.ServiceNameAlreadyRegistered:
+            self._logger.warning(
+                "Ignoring %s because %s is already registered", rec.owner_id, rec.fqdn
+            )
 
-        # Modify records
-        for rec in set(self._registered.keys()).intersection(local_records):
-            si = self._registered[rec]
-            if si.port != rec.port:
-                si.port = rec.port
-                self._logger.info(
-                    f"Modified port from {si.port} to {rec.port} for {rec.owner_id}"
-                )
-            old_ip = ipaddress.ip_interface(si.addresses[0])
-            new_ip = ipaddress.ip_interface(rec.ip_address)
-            if old_ip.ip != new_ip.ip:
-                si.addresses = [new_ip.packed]
-                self._logger.info(
-                    f"Modified IP address from {old_ip} to {new_ip} for {rec.owner_id}"
-                )
+    async def _modify(self, current: Record, rec: Record):
+        key = self._service_key(rec)
+        if current not in self._records.get(key, ()):
+            await self._remove(current)
+            await self._add(rec)
+            return
+        self._records[key].discard(current)
+        self._records[key].add(rec)
+        await self._publish(key)
+
+    async def _publish(self, key: typing.Tuple[str, str]):
+        """
+        Update the service with the port and all addresses of its records
+        """
+        si = self._services[key]
+        records = self._records[key]
+        port = min(rec.port for rec in records)
+        addresses = sorted(
+            {ipaddress.ip_address(rec.ip_address) for rec in records},
+            key=lambda address: (address.version, address),
+        )
+        current = {
+            ipaddress.ip_address(address)
+            for address in si.addresses_by_version(zeroconf.IPVersion.All)
+        }
+        if si.port == port and current == set(addresses):
+            # Every update is re-announced on the network, so we only do so for real changes
+            self.avoided_announcements += 1
+            return
+        owner_id, fqdn = key
+        self._logger.info(
+            "Modified %s to point to %s:%d for %s",
+            fqdn,
+            ", ".join(str(a) for a in addresses),
+            port,
+            owner_id,
+        )
+        si.port = port
+        si.addresses = [address.packed for address in addresses]
+        with metrics.MULTICAST_SECONDS.time(operation="update"):
             await self._aiozc.async_update_service(si)
 
 
+class UpdateTransport:
+    """
+    Sends DNS UPDATE messages without blocking the event loop. Connections to the nameserver
+    are kept open for re-use and re-established when the nameserver closes them, the number of
+    messages in flight is bounded by the size of the connection pool
+    """
+
+    def __init__(
+        self, ip: str, port: int = 53, timeout: float = 10, max_in_flight: int = 4
+    ) -> None:
+        self._logger = logging.getLogger(self.__class__.__name__)
+        self._ip = ip
+        self._port = port
+        self._timeout = timeout
+        self._backend = dns.asyncbackend.get_default_backend()
+        self._in_flight = asyncio.Semaphore(max_in_flight)
+        self._idle: typing.List[dns.asyncbackend.StreamSocket] = []
+
+    async def send(self, message: dns.message.Message) -> dns.message.Message:
+        """
+        Send the message and return the response of the nameserver
+        """
+        async with self._in_flight:
+            sock = self._idle.pop() if len(self._idle) > 0 else None
+            if sock is not None:
+                try:
+                    return await self._query(message, sock)
+                except (EOFError, OSError):
+                    # The nameserver has likely closed the idle connection, so we reconnect
+                    self._logger.debug("Reconnecting to %s:%d", self._ip, self._port)
+            sock = await self._backend.make_socket(
+                dns.inet.af_for_address(self._ip),
+                socket.SOCK_STREAM,
+                0,
+                None,
+                (self._ip, self._port),
+                self._timeout,
+            )
+            return await self._query(message, sock)
+
+    async def close(self):
+        """
+        Close all idle connections
+        """
+        while len(self._idle) > 0:
+            await self._idle.pop().close()
+
+    async def _query(
+        self, message: dns.message.Message, sock: dns.asyncbackend.StreamSocket
+    ) -> dns.message.Message:
+        try:
+            response = await dns.asyncquery.tcp(
+                message, self._ip, timeout=self._timeout, sock=sock
+            )
+        except BaseException:
+            # The state of the connection is unknown, it must not be re-used
+            await sock.close()
+            raise
+        self._idle.append(sock)
+        return response
+
+
+def rdtype(ip_address: str) -> str:
+    """
+    Return the type of the address record for an IP address
+    """
+    return "AAAA" if ipaddress.ip_address(ip_address).version == 6 else "A"
+
+
+@dataclasses.dataclass(frozen=True)
+class UpdateOperation:
+    """
+    A single change to a record
+    """
+
+    action: str
+    rec: Record
+    current: Record | None = None
+
+
+@dataclasses.dataclass(frozen=True)
+class RRSetUpdate:
+    """
+    The addresses a name has after a number of changes to its records. Within a DNS UPDATE
+    message, they replace the A and AAAA RRsets of the name the changes touched
+    """
+
+    fqdn: str
+    addresses: typing.Dict[str, typing.FrozenSet[str]]
+    rdtypes: typing.FrozenSet[str]
+    ops: typing.Tuple[UpdateOperation, ...]
+
+    def apply_to(self, update: dns.update.Update, ttl: int):
+        """
+        Add the change to the provided DNS UPDATE message
+        """
+        for rdtype in sorted(self.rdtypes):
+            addresses = self.addresses.get(rdtype, frozenset())
+            if len(addresses) == 0:
+                update.delete(self.fqdn, rdtype)
+            else:
+                update.replace(self.fqdn, ttl, rdtype, *sorted(addresses))
+
+    @property
+    def wire_size(self) -> int:
+        """
+        An estimate of the size this change adds to a DNS UPDATE message
+        """
+        return (len(self.fqdn) + 16) * max(
+            1, sum(len(addresses) for addresses in self.addresses.values())
+        )
+
+
 class UnicastNameserver(BaseNameserver):
     """
-    Registers names in a more traditional DNS nameserver
+    Registers names in a more traditional DNS nameserver. All addresses of a name are published
+    as its A and AAAA RRsets, and changes are batched into as few DNS UPDATE messages as their
+    configured maximum size permits
     """
 
     def __init__(self, registry: Registry, *args, **kwargs):
-        super().__init__(registry)
-        self._registered: typing.Set[Record] = set()
-        self._keyring = None
-        self._ip = kwargs.get("ip", "127.0.0.1")
         self._domain = kwargs.get("domain", "kube-eng.k8s")
         if not self._domain.endswith("."):
             self._domain += "."
+        super().__init__(registry, zone=self._domain)
+        self._registered: typing.Set[Record] = set()
+        self._by_fqdn: typing.Dict[str, typing.Set[Record]] = {}
+        self._published: typing.Dict[str, typing.Dict[str, typing.FrozenSet[str]]] = {}
+        self._pending: typing.List[UpdateOperation] = []
+        self.suppressed_updates = 0
+        self._keyring = None
+        self._ttl = 300
+        self._ip = kwargs.get("ip", "127.0.0.1")
+        self._port = kwargs.get("port", 53)
+        self._batch_size = max(1, kwargs.get("batch_size", 100))
+        self._batch_max_bytes = kwargs.get("batch_max_bytes", 16384)
         if (
             "key" in kwargs
             and "secret" in kwargs
@@ -124,62 +362,208 @@ class UnicastNameserver(BaseNameserver):
             and kwargs["secret"] is not None
         ):
             self._keyring = dns.tsigkeyring.from_text({kwargs["key"]: kwargs["secret"]})
+        self._transport = UpdateTransport(
+            self._ip, port=self._port, max_in_flight=kwargs.get("max_in_flight", 4)
+        )
+        self.snapshot_key = f"{self._ip}:{self._port}/{self._domain}"
 
     async def shutdown(self):
         """
         Shutdown the nameserver
         """
-        pass
+        await self._transport.close()
+
+    def status(self) -> typing.Dict[str, typing.Any]:
+        return {"suppressed_updates": self.suppressed_updates}
+
+    def registered(self) -> typing.Set[Record]:
+        return set(self._registered)
+
+    async def withdraw(self):
+        # The records stay in DNS for the replica taking over, we merely forget about them so
+        # we publish them all again should we take over later
+        self._pending.clear()
+        self._registered.clear()
+        self._by_fqdn.clear()
+        self._published.clear()
+
+    def restore(self, records: typing.Set[Record]):
+        for rec in records:
+            self._register(rec)
+        for fqdn, by_fqdn in self._by_fqdn.items():
+            addresses: typing.Dict[str, typing.Set[str]] = {}
+            for rec in by_fqdn:
+                addresses.setdefault(rdtype(rec.ip_address), set()).add(rec.ip_address)
+            self._published[fqdn] = {
+                key: frozenset(value) for key, value in addresses.items()
+            }
 
     async def update(self, records: typing.Set[Record]):
-        # Filter out records that do not end in the local domain
-        local_records = set(
-            filter(lambda r: r.fqdn.endswith(f"{self._domain}"), records)
-        )
+        await super().update(records)
+        await self._send_pending()
 
-        # Remove records
-        for rec in set(self._registered).difference(local_records):
-            try:
-                update = dns.update.Update(self._domain, keyring=self._keyring)
-                update.delete(rec.fqdn, 300, "A", rec.ip_address)
-                response = dns.query.tcp(update, self._ip, timeout=10)
-                if response.rcode() != dns.rcode.NOERROR:
-                    self._logger.warning(f"Failed to remove {rec.fqdn}")
-                else:
-                    self._logger.info(
-                        f"Record {rec.owner_id} removes {rec.fqdn} on {rec.ip_address}"
-                    )
-                    self._registered.remove(rec)
-            except dns.exception.DNSException as de:
-                self._logger.warning(f"Exception while removing {rec.fqdn}: {de}")
+    async def apply(self, changes: ChangeSet):
+        await super().apply(changes)
+        await self._send_pending()
+
+    async def remove(self, rec: Record):
+        self._pending.append(UpdateOperation("remove", rec))
+
+    async def modify(self, current: Record, rec: Record):
+        self._pending.append(UpdateOperation("modify", rec, current))
+
+    async def add(self, rec: Record):
+        self._pending.append(UpdateOperation("add", rec))
 
-        # Modify records
-        for rec in set(self._registered).intersection(local_records):
+    async def _send_pending(self):
+        pending, self._pending = self._pending, []
+        by_fqdn: typing.Dict[str, typing.List[UpdateOperation]] = {}
+        for op in pending:
+            by_fqdn.setdefault(op.rec.fqdn, []).append(op)
+        updates = []
+        for fqdn, ops in by_fqdn.items():
+            update = self._rrset_update(fqdn, ops)
+            if update.addresses == self._published.get(fqdn):
+                # The name already has exactly these addresses, such as when reconciling
+                self.suppressed_updates += 1
+                self._logger.debug("Suppressed unchanged update of %s", fqdn)
+                for op in ops:
+                    self._commit(op)
+                continue
+            updates.append(update)
+        await asyncio.gather(*(self._send_batch(b) for b in self._batches(updates)))
+
+    def _rrset_update(
+        self, fqdn: str, ops: typing.List[UpdateOperation]
+    ) -> RRSetUpdate:
+        """
+        Work out the addresses of a name once the operations on its records are applied
+        """
+        records = set(self._by_fqdn.get(fqdn, ()))
+        rdtypes = set(self._published.get(fqdn, {}).keys())
+        for op in ops:
+            if op.current is not None:
+                records.discard(op.current)
+            if op.action == "remove":
+                records.discard(op.rec)
+            else:
+                records.add(op.rec)
+        addresses: typing.Dict[str, typing.Set[str]] = {}
+        for rec in records:
             try:
-                update = dns.update.Update(self._domain, keyring=self._keyring)
-                update.replace(rec.fqdn, 300, "A", rec.ip_address)
-                response = dns.query.tcp(update, self._ip, timeout=10)
-                if response.rcode() != dns.rcode.NOERROR:
-                    self._logger.warning(f"Failed to modify {rec.fqdn}")
-                else:
-                    self._logger.info(
-                        f"Record {rec.owner_id} modifies {rec.fqdn} to {rec.ip_address}"
-                    )
-            except dns.exception.DNSException as de:
-                self._logger.warning(f"Exception while modifying {rec.fqdn}: {de}")
+                addresses.setdefault(rdtype(rec.ip_address), set()).add(rec.ip_address)
+            except ValueError:
+                self._logger.warning(
+                    "Ignoring %s for %s: %s is not an IP address",
+                    rec.owner_id,
+                    fqdn,
+                    rec.ip_address,
+                )
+        rdtypes.update(addresses.keys())
+        return RRSetUpdate(
+            fqdn=fqdn,
+            addresses={key: frozenset(value) for key, value in addresses.items()},
+            rdtypes=frozenset(rdtypes),
+            ops=tuple(ops),
+        )
+
+    def _batches(
+        self, updates: typing.List[RRSetUpdate]
+    ) -> typing.Iterator[typing.List[RRSetUpdate]]:
+        """
+        Pack the updates of names into batches
+        """
+        batch: typing.List[RRSetUpdate] = []
+        size = 0
+        for update in updates:
+            if len(batch) > 0 and (
+                len(batch) + 1 > self._batch_size
+                or size + update.wire_size > self._batch_max_bytes
+            ):
+                yield batch
+                batch, size = [], 0
+            batch.append(update)
+            size += update.wire_size
+        if len(batch) > 0:
+            yield batch
 
-        # Add records
-        for rec in local_records.difference(self._registered):
+    async def _send_batch(self, batch: typing.List[RRSetUpdate]):
+        update = dns.update.Update(self._domain, keyring=self._keyring)
+        valid = []
+        for rrset in batch:
             try:
-                add = dns.update.Update(self._domain, keyring=self._keyring)
-                add.replace(rec.fqdn, 300, "A", rec.ip_address)
-                response = dns.query.tcp(add, self._ip, timeout=10)
-                if response.rcode() != dns.rcode.NOERROR:
-                    self._logger.warning(f"Failed to add {rec.fqdn}")
-                else:
-                    self._logger.info(
-                        f"Record {rec.owner_id} adds {rec.fqdn} to {rec.ip_address}"
-                    )
-                    self._registered.add(rec)
+                rrset.apply_to(update, self._ttl)
+                valid.append(rrset)
             except dns.exception.DNSException as de:
-                self._logger.warning(f"Exception while adding {rec.fqdn}: {de}")
+                self._logger.warning("Ignoring changes to %s: %s", rrset.fqdn, de)
+        if len(valid) == 0:
+            return
+        try:
+            with metrics.UNICAST_UPDATE_SECONDS.time():
+                response = await self._transport.send(update)
+        except (dns.exception.DNSException, OSError, EOFError) as de:
+            metrics.UNICAST_UPDATE_ERRORS.inc(rcode=de.__class__.__name__)
+            self._logger.warning(
+                "Exception while sending a batch of %d changes: %s", len(valid), de
+            )
+            return
+        rcode = response.rcode()
+        if rcode == dns.rcode.NOERROR:
+            for rrset in valid:
+                self._published[rrset.fqdn] = rrset.addresses
+                for op in rrset.ops:
+                    self._commit(op)
+            return
+        metrics.UNICAST_UPDATE_ERRORS.inc(rcode=dns.rcode.to_text(rcode))
+        if len(valid) == 1:
+            self._logger.warning(
+                "Failed to update %s: %s", valid[0].fqdn, dns.rcode.to_text(rcode)
+            )
+            return
+        # The nameserver rejects an UPDATE as a whole, so we split the batch to find the offender
+        self._logger.warning(
+            "Batch of %d changes failed with %s, splitting it",
+            len(valid),
+            dns.rcode.to_text(rcode),
+        )
+        half = len(valid) // 2
+        await self._send_batch(valid[:half])
+        await self._send_batch(valid[half:])
+
+    def _commit(self, op: UpdateOperation):
+        # The registry already logs every change at INFO, we only confirm it was published
+        rec = op.rec
+        match op.action:
+            case "remove":
+                self._unregister(rec)
+                self._logger.debug(
+                    "Record %s removes %s on %s", rec.owner_id, rec.fqdn, rec.ip_address
+                )
+            case "modify":
+                if op.current is not None:
+                    self._unregister(op.current)
+                self._register(rec)
+                self._logger.debug(
+                    "Record %s modifies %s to %s",
+                    rec.owner_id,
+                    rec.fqdn,
+                    rec.ip_address,
+                )
+            case "add":
+                self._register(rec)
+                self._logger.debug(
+                    "Record %s adds %s to %s", rec.owner_id, rec.fqdn, rec.ip_address
+                )
+
+    def _register(self, rec: Record):
+        self._registered.add(rec)
+        self._by_fqdn.setdefault(rec.fqdn, set()).add(rec)
+
+    def _unregister(self, rec: Record):
+        self._registered.discard(rec)
+        records = self._by_fqdn.get(rec.fqdn)
+        if records is None:
+            return
+        records.discard(rec)
+        if len(records) == 0:
+            del self._by_fqdn[rec.fqdn]
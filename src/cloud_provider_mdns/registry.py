@@ -21,58 +21,330 @@
 #  SOFTWARE.
 
 import typing
+import asyncio
 import logging
+import collections
 
 import kubernetes_asyncio  # type: ignore[import-untyped]
 
+from cloud_provider_mdns import metrics
+
 from cloud_provider_mdns.base import (
     KubernetesGateway,
     HTTPRoute,
     Record,
+    ChangeSet,
+    BaseTask,
+    BaseWatcher,
     BaseNameserver,
 )
 
 
-class Registry:
+def labels(name: str) -> typing.Tuple[str, ...]:
+    """
+    Return the labels of a domain name from the root down, so "app.k8s." yields ("k8s", "app")
+    """
+    name = name.strip(".").lower()
+    if name == "":
+        return ()
+    return tuple(reversed(name.split(".")))
+
+
+class SuffixNode:
+    __slots__ = ("children", "records")
+
+    def __init__(self) -> None:
+        self.children: typing.Dict[str, SuffixNode] = {}
+        self.records: typing.Set[Record] = set()
+
+
+class SuffixTrie:
+    """
+    Records indexed by the labels of their FQDN from the root down, so the records within a
+    domain are found by walking down to it rather than by scanning every record
+    """
+
+    def __init__(self) -> None:
+        self._root = SuffixNode()
+
+    def add(self, record: Record):
+        node = self._root
+        for label in labels(record.fqdn):
+            node = node.children.setdefault(label, SuffixNode())
+        node.records.add(record)
+
+    def remove(self, record: Record):
+        path = [self._root]
+        for label in labels(record.fqdn):
+            node = path[-1].children.get(label)
+            if node is None:
+                return
+            path.append(node)
+        path[-1].records.discard(record)
+        # Prune the nodes left without records or children
+        for label, parent, node in zip(
+            reversed(labels(record.fqdn)), reversed(path[:-1]), reversed(path[1:])
+        ):
+            if len(node.records) > 0 or len(node.children) > 0:
+                break
+            del parent.children[label]
+
+    def under(self, domain: typing.Tuple[str, ...]) -> typing.Set[Record]:
+        """
+        Return the records within the domain given by its labels from the root down
+        """
+        node = self._root
+        for label in domain:
+            next_node = node.children.get(label)
+            if next_node is None:
+                return set()
+            node = next_node
+        records: typing.Set[Record] = set()
+        nodes = [node]
+        while len(nodes) > 0:
+            node = nodes.pop()
+            records.update(node.records)
+            nodes.extend(node.children.values())
+        return records
+
+    def clear(self):
+        self._root = SuffixNode()
+
+
+class RecordStore:
+    """
+    A set of records indexed by owner, gateway, hostname and domain so lookups cost
+    O(matches) rather than a scan over every record we maintain
+    """
+
     def __init__(self) -> None:
+        self._records: typing.Set[Record] = set()
+        self._by_owner: typing.Dict[str, typing.Set[Record]] = collections.defaultdict(
+            set
+        )
+        self._by_gateway: typing.Dict[str, typing.Set[Record]] = (
+            collections.defaultdict(set)
+        )
+        self._by_hostname: typing.Dict[str, typing.Set[Record]] = (
+            collections.defaultdict(set)
+        )
+        self._by_domain = SuffixTrie()
+
+    def add(self, record: Record) -> bool:
+        """
+        Add a record to the store, returns False if it was already present
+        """
+        if record in self._records:
+            return False
+        self._records.add(record)
+        self._by_owner[record.owner_id].add(record)
+        self._by_gateway[record.gateway_id].add(record)
+        self._by_hostname[record.hostname].add(record)
+        self._by_domain.add(record)
+        return True
+
+    def remove(self, record: Record) -> bool:
+        """
+        Remove a record from the store, returns False if it was not present
+        """
+        if record not in self._records:
+            return False
+        self._records.remove(record)
+        self._unindex(self._by_owner, record.owner_id, record)
+        self._unindex(self._by_gateway, record.gateway_id, record)
+        self._unindex(self._by_hostname, record.hostname, record)
+        self._by_domain.remove(record)
+        return True
+
+    def by_owner(self, owner_id: str) -> typing.Set[Record]:
+        return set(self._by_owner.get(owner_id, ()))
+
+    def by_gateway(self, gateway_id: str) -> typing.Set[Record]:
+        return set(self._by_gateway.get(gateway_id, ()))
+
+    def by_hostname(self, hostname: str) -> typing.Set[Record]:
+        return set(self._by_hostname.get(hostname, ()))
+
+    def by_domain(self, domain: str) -> typing.Set[Record]:
+        """
+        Return the records whose FQDN is within the provided domain
+        """
+        return self.by_domain_labels(labels(domain))
+
+    def by_domain_labels(self, domain: typing.Tuple[str, ...]) -> typing.Set[Record]:
+        if domain == ():
+            return set(self._records)
+        return self._by_domain.under(domain)
+
+    def by_owner_and_hostname(self, owner_id: str, hostname: str) -> typing.Set[Record]:
+        """
+        Return the records of an owner for a hostname, scanning the smaller of both indices
+        """
+        by_owner = self._by_owner.get(owner_id, set())
+        by_hostname = self._by_hostname.get(hostname, set())
+        if len(by_owner) > len(by_hostname):
+            by_owner, by_hostname = by_hostname, by_owner
+        return {r for r in by_owner if r in by_hostname}
+
+    def all(self) -> typing.Set[Record]:
+        return self._records
+
+    def clear(self):
+        self._records.clear()
+        self._by_owner.clear()
+        self._by_gateway.clear()
+        self._by_hostname.clear()
+        self._by_domain.clear()
+
+    def __contains__(self, record: object) -> bool:
+        return record in self._records
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    def __iter__(self) -> typing.Iterator[Record]:
+        return iter(self._records)
+
+    @staticmethod
+    def _unindex(
+        index: typing.Dict[str, typing.Set[Record]], key: str, record: Record
+    ) -> None:
+        bucket = index.get(key)
+        if bucket is None:
+            return
+        bucket.discard(record)
+        if len(bucket) == 0:
+            del index[key]
+
+
+class NotificationScheduler:
+    """
+    Coalesces the change sets of mutations within a window of time or up to a number of
+    changes and delivers them as a single consolidated change set
+    """
+
+    def __init__(
+        self,
+        deliver: typing.Callable[[ChangeSet], typing.Awaitable[None]],
+        window: float = 0,
+        max_changes: int = 0,
+    ) -> None:
+        self._logger = logging.getLogger(self.__class__.__name__)
+        self._deliver = deliver
+        self._window = window
+        self._max_changes = max_changes
+        self._pending = ChangeSet()
+        self._pending_events = 0
+        self._timer: asyncio.Task | None = None
+        self._lock = asyncio.Lock()
+        self.flushes = 0
+        self.merged_events = 0
+        self.last_merged_events = 0
+
+    async def schedule(self, changes: ChangeSet):
+        """
+        Schedule the delivery of a change set, delivering immediately when no window is
+        configured or the maximum number of pending changes is reached
+        """
+        if not changes:
+            return
+        self._pending.merge(changes)
+        self._pending_events += 1
+        if self._window <= 0 or (
+            self._max_changes > 0 and len(self._pending) >= self._max_changes
+        ):
+            await self.flush()
+        elif self._timer is None:
+            self._timer = asyncio.create_task(self._flush_later())
+
+    async def flush(self):
+        """
+        Deliver all pending changes now
+        """
+        if self._timer is not None:
+            self._timer.cancel()
+        self._timer = None
+        async with self._lock:
+            changes, events = self._pending, self._pending_events
+            self._pending, self._pending_events = ChangeSet(), 0
+            if events == 0:
+                return
+            self.flushes += 1
+            self.merged_events += events
+            self.last_merged_events = events
+            metrics.NOTIFY_MERGED_EVENTS.observe(events)
+            self._logger.debug(
+                "Flushing %d changes merged from %d events", len(changes), events
+            )
+            if changes:
+                await self._deliver(changes)
+
+    async def _flush_later(self):
+        try:
+            await asyncio.sleep(self._window)
+            self._timer = None
+            await self.flush()
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            self._logger.exception("Failed to deliver changes")
+
+
+class Registry:
+    def __init__(
+        self,
+        notify_window: float = 0,
+        notify_max_changes: int = 0,
+        publishing: bool = True,
+    ) -> None:
         self._logger = logging.getLogger(self.__class__.__name__)
         self._gateways: typing.Dict[str, KubernetesGateway] = {}
         self._routes: typing.Dict[str, HTTPRoute] = {}
+        self._routes_by_gateway: typing.Dict[str, typing.Set[str]] = (
+            collections.defaultdict(set)
+        )
         self._ingresses: typing.Dict[str, kubernetes_asyncio.client.V1Ingress] = {}
 
-        self._records: typing.Set[Record] = set()
-        self._subscribers: typing.Set[BaseNameserver] = set()
+        self._records = RecordStore()
+        self._zones: typing.Dict[typing.Tuple[str, ...], typing.Set[BaseNameserver]] = (
+            collections.defaultdict(set)
+        )
+        self._scheduler = NotificationScheduler(
+            self._deliver, window=notify_window, max_changes=notify_max_changes
+        )
+        # A standby keeps its records up to date without publishing them
+        self.publishing = publishing
+        self._publishing_lock = asyncio.Lock()
 
     async def add_record(self, record: Record):
-        self._records.add(record)
-        await self._notify_subscribers()
-        self._logger.info(f"{record.owner_id} adds {record.hostname}")
+        changes = ChangeSet()
+        self._add(record, changes)
+        await self._notify_subscribers(changes)
+        self._logger.info("%s adds %s", record.owner_id, record.hostname)
 
     async def modify_record(self, record: Record):
         current = list(
-            filter(
-                lambda r: r.owner_id == record.owner_id
-                and r.hostname == record.hostname,
-                self._records,
-            )
+            self._records.by_owner_and_hostname(record.owner_id, record.hostname)
         )
         if len(current) == 0:
             await self.add_record(record)
             return
-        self._records.remove(current[0])
-        self._records.add(record)
-        await self._notify_subscribers()
-        self._logger.info(f"{record.owner_id} updates {record.hostname}")
+        changes = ChangeSet()
+        self._remove(current[0], changes)
+        self._add(record, changes)
+        await self._notify_subscribers(changes)
+        self._logger.info("%s updates %s", record.owner_id, record.hostname)
 
     async def remove_record(self, record: Record):
+        changes = ChangeSet()
         if record not in self._records:
             self._logger.warning(
-                f"{record.owner_id} has already been removed from the registry"
+                "%s has already been removed from the registry", record.owner_id
             )
         else:
-            self._records.remove(record)
-        await self._notify_subscribers()
-        self._logger.info(f"{record.owner_id} removes {record.hostname}")
+            self._remove(record, changes)
+        await self._notify_subscribers(changes)
+        self._logger.info("%s removes %s", record.owner_id, record.hostname)
 
     async def add_gateway(self, gateway: KubernetesGateway):
         gateway_id = f"{gateway.metadata.namespace}/{gateway.metadata.name}"
@@ -80,145 +352,437 @@ class Registry:
             await self.modify_gateway(gateway)
             return
         self._gateways[gateway_id] = gateway
-        self._logger.info(f"Added gateway {gateway_id}")
-        for route in self._routes.values():
-            resource_id = f"{route.metadata.namespace}/{route.metadata.name}"
-            for parent_ref in route.spec.parentRefs:
-                gateway_id = f"{parent_ref.namespace or route.metadata.namespace}/{parent_ref.name}"
-                if not gateway_id in self._gateways:
-                    self._logger.warning(
-                        f"{resource_id} Specifies gateway {gateway_id} "
-                        f"but it is not (yet) a known gateway"
-                    )
-                    continue
-                gw = self._gateways[gateway_id]
-                for hostname in route.spec.hostnames:
-                    port = None
-                    if parent_ref.port is not None:
-                        port = parent_ref.port
-                    elif parent_ref.sectionName is not None:
-                        port = gw.port_by_section_name(parent_ref.sectionName)
-                    if port is None:
-                        port = 80
-                    for ip_address in gw.addresses():
-                        rec = Record(
-                            owner_id=resource_id,
-                            gateway_id=gateway_id,
-                            hostname=hostname,
-                            ip_address=ip_address,
-                            port=port,
-                        )
-                        self._records.add(rec)
-        await self._notify_subscribers()
+        self._logger.info("Added gateway %s", gateway_id)
+        changes = ChangeSet()
+        for route_id in self._routes_by_gateway.get(gateway_id, ()):
+            for rec in self._route_records(self._routes[route_id], gateway_id):
+                self._add(rec, changes)
+        await self._notify_subscribers(changes)
 
     async def modify_gateway(self, gateway: KubernetesGateway):
-        resource_id = f"{gateway.metadata.namespace}/{gateway.metadata.name}"
-        if resource_id in self._gateways:
-            await self.remove_gateway(gateway)
-        await self.add_gateway(gateway)
+        """
+        Re-derive only the records of the routes attached to the gateway, publishing the
+        difference to the records derived before as a single change
+        """
+        gateway_id = f"{gateway.metadata.namespace}/{gateway.metadata.name}"
+        if gateway_id not in self._gateways:
+            await self.add_gateway(gateway)
+            return
+        self._gateways[gateway_id] = gateway
+        records: typing.Set[Record] = set()
+        for route_id in self._routes_by_gateway.get(gateway_id, ()):
+            records.update(self._route_records(self._routes[route_id], gateway_id))
+        changes = ChangeSet()
+        self._replace(self._records.by_gateway(gateway_id), records, changes)
+        await self._notify_subscribers(changes)
+        self._logger.info("Modified gateway %s", gateway_id)
 
     async def remove_gateway(self, gateway: KubernetesGateway):
         gateway_id = f"{gateway.metadata.namespace}/{gateway.metadata.name}"
         if not gateway_id in self._gateways:
-            self._logger.warning(f"{gateway_id} is not a known gateway")
+            self._logger.warning("%s is not a known gateway", gateway_id)
             return
-        records = list(filter(lambda r: r.gateway_id == gateway_id, self._records))
-        for rec in records:
-            self._records.remove(rec)
+        changes = ChangeSet()
+        for rec in self._records.by_gateway(gateway_id):
+            self._remove(rec, changes)
         del self._gateways[gateway_id]
-        await self._notify_subscribers()
+        await self._notify_subscribers(changes)
 
     async def add_route(self, route: HTTPRoute):
         resource_id = f"{route.metadata.namespace}/{route.metadata.name}"
         if resource_id in self._routes:
             await self.modify_route(route)
             return
-        self._routes[resource_id] = route
+        self._index_route(resource_id, route)
+        changes = ChangeSet()
+        for rec in self._route_records(route):
+            self._add(rec, changes)
+        await self._notify_subscribers(changes)
+
+    async def modify_route(self, route: HTTPRoute):
+        """
+        Re-derive the records of the route, publishing the difference to the records derived
+        before as a single change
+        """
+        resource_id = f"{route.metadata.namespace}/{route.metadata.name}"
+        if not resource_id in self._routes:
+            self._logger.warning("%s is not a known HTTP route", resource_id)
+            return
+        self._unindex_route(resource_id)
+        self._index_route(resource_id, route)
+        changes = ChangeSet()
+        self._replace(
+            self._records.by_owner(resource_id), self._route_records(route), changes
+        )
+        await self._notify_subscribers(changes)
+
+    async def remove_route(self, route: HTTPRoute):
+        resource_id = f"{route.metadata.namespace}/{route.metadata.name}"
+        if not resource_id in self._routes:
+            self._logger.warning("%s is not a known HTTP route", resource_id)
+            return
+        changes = ChangeSet()
+        for rec in self._records.by_owner(resource_id):
+            self._remove(rec, changes)
+        self._unindex_route(resource_id)
+        await self._notify_subscribers(changes)
 
+    def _route_records(
+        self, route: HTTPRoute, gateway_id: str | None = None
+    ) -> typing.Set[Record]:
+        """
+        Derive the records of a route from the gateways it is attached to and we know of, or
+        only from the provided gateway
+        """
+        resource_id = f"{route.metadata.namespace}/{route.metadata.name}"
+        records: typing.Set[Record] = set()
         for parent_ref in route.spec.parentRefs:
-            gateway_id = (
+            parent_id = (
                 f"{parent_ref.namespace or route.metadata.namespace}/{parent_ref.name}"
             )
-            if not gateway_id in self._gateways:
+            if gateway_id is not None and parent_id != gateway_id:
+                continue
+            if not parent_id in self._gateways:
                 self._logger.warning(
-                    f"{resource_id} specifies gateway {gateway_id} but it is "
-                    f"not (yet) known"
+                    "%s specifies gateway %s but it is not (yet) known",
+                    resource_id,
+                    parent_id,
                 )
                 continue
-            gw = self._gateways[gateway_id]
+            gw = self._gateways[parent_id]
+            port = None
+            if parent_ref.port is not None:
+                port = parent_ref.port
+            elif parent_ref.sectionName is not None:
+                port = gw.port_by_section_name(parent_ref.sectionName)
+            if port is None:
+                port = 80
             for hostname in route.spec.hostnames:
-                port = None
-                if parent_ref.port is not None:
-                    port = parent_ref.port
-                elif parent_ref.sectionName is not None:
-                    port = gw.port_by_section_name(parent_ref.sectionName)
-                if port is None:
-                    port = 80
                 for ip_address in gw.addresses():
-                    rec = Record(
-                        owner_id=resource_id,
-                        gateway_id=gateway_id,
-                        hostname=hostname,
-                        ip_address=ip_address,
-                        port=port,
+                    records.add(
+                        Record(
+                            owner_id=resource_id,
+                            gateway_id=parent_id,
+                            hostname=hostname,
+                            ip_address=ip_address,
+                            port=port,
+                        )
                     )
-                    self._records.add(rec)
-        await self._notify_subscribers()
+        return records
 
-    async def modify_route(self, route: HTTPRoute):
-        resource_id = f"{route.metadata.namespace}/{route.metadata.name}"
-        if not resource_id in self._routes:
-            self._logger.warning(f"{resource_id} is not a known HTTP route")
-            return
-        await self.remove_route(route)
-        await self.add_route(route)
+    def _index_route(self, resource_id: str, route: HTTPRoute):
+        self._routes[resource_id] = route
+        for parent_ref in route.spec.parentRefs:
+            gateway_id = (
+                f"{parent_ref.namespace or route.metadata.namespace}/{parent_ref.name}"
+            )
+            self._routes_by_gateway[gateway_id].add(resource_id)
 
-    async def remove_route(self, route: HTTPRoute):
-        resource_id = f"{route.metadata.namespace}/{route.metadata.name}"
-        if not resource_id in self._routes:
-            self._logger.warning(f"{resource_id} is not a known HTTP route")
-            return
-        records = list(filter(lambda r: r.owner_id == resource_id, self._records))
-        for rec in records:
-            self._records.remove(rec)
-        del self._routes[resource_id]
-        await self._notify_subscribers()
+    def _unindex_route(self, resource_id: str):
+        route = self._routes.pop(resource_id)
+        for parent_ref in route.spec.parentRefs:
+            gateway_id = (
+                f"{parent_ref.namespace or route.metadata.namespace}/{parent_ref.name}"
+            )
+            self._routes_by_gateway[gateway_id].discard(resource_id)
+            if len(self._routes_by_gateway[gateway_id]) == 0:
+                del self._routes_by_gateway[gateway_id]
+
+    def _replace(
+        self,
+        current: typing.Set[Record],
+        records: typing.Set[Record],
+        changes: ChangeSet,
+    ):
+        """
+        Replace the current records by the provided ones, leaving the records in both alone
+        """
+        for rec in current - records:
+            self._remove(rec, changes)
+        for rec in records - current:
+            self._add(rec, changes)
+
+    async def replace_records(self, owner_id: str, records: typing.Set[Record]):
+        """
+        Replace all records of the owner by the provided ones, publishing the difference as a
+        single change
+        """
+        changes = ChangeSet()
+        self._replace(self._records.by_owner(owner_id), records, changes)
+        await self._notify_subscribers(changes)
+        if len(changes) > 0:
+            self._logger.info("%s now has %d records", owner_id, len(records))
+
+    async def remove_owners(self, owner_ids: typing.Iterable[str]):
+        """
+        Remove all records of the owners as one change
+        """
+        changes = ChangeSet()
+        for owner_id in owner_ids:
+            for rec in self._records.by_owner(owner_id):
+                self._remove(rec, changes)
+            self._logger.info("Swept records of %s", owner_id)
+        await self._notify_subscribers(changes)
+
+    async def sweep_gateways(self, seen: typing.Set[str]):
+        """
+        Remove the gateways which are not among those seen, along with their records, as one
+        change
+        """
+        changes = ChangeSet()
+        for gateway_id in set(self._gateways) - seen:
+            for rec in self._records.by_gateway(gateway_id):
+                self._remove(rec, changes)
+            del self._gateways[gateway_id]
+            self._logger.info("Swept gateway %s", gateway_id)
+        await self._notify_subscribers(changes)
+
+    async def sweep_routes(self, seen: typing.Set[str], namespace: str | None = None):
+        """
+        Remove the HTTP routes which are not among those seen, along with their records, as
+        one change. Given a namespace, only the HTTP routes within it are swept
+        """
+        changes = ChangeSet()
+        for resource_id in set(self._routes) - seen:
+            if namespace is not None and not resource_id.startswith(f"{namespace}/"):
+                continue
+            for rec in self._records.by_owner(resource_id):
+                self._remove(rec, changes)
+            self._unindex_route(resource_id)
+            self._logger.info("Swept HTTP route %s", resource_id)
+        await self._notify_subscribers(changes)
 
     async def add_ingress(self, ingress: kubernetes_asyncio.client.V1Ingress):
+        """
+        Publish a record for every host of the ingress on each of its load balancer addresses.
+        Adding an ingress we already know only publishes the records that changed
+        """
         resource_id = f"{ingress.metadata.namespace}/{ingress.metadata.name}"
-        if resource_id in self._ingresses:
-            await self.modify_ingress(ingress)
-            return
         self._ingresses[resource_id] = ingress
-        await self._notify_subscribers()
+        changes = ChangeSet()
+        self._replace(
+            self._records.by_owner(resource_id), self._ingress_records(ingress), changes
+        )
+        await self._notify_subscribers(changes)
 
     async def modify_ingress(self, ingress: kubernetes_asyncio.client.V1Ingress):
-        resource_id = f"{ingress.metadata.namespace}/{ingress.metadata.name}"
-        if resource_id in self._ingresses:
-            await self.remove_ingress(ingress)
         await self.add_ingress(ingress)
 
     async def remove_ingress(self, ingress: kubernetes_asyncio.client.V1Ingress):
         resource_id = f"{ingress.metadata.namespace}/{ingress.metadata.name}"
-        if resource_id in self._ingresses:
+        if resource_id not in self._ingresses:
+            self._logger.warning("%s is not a known ingress", resource_id)
+            return
+        changes = ChangeSet()
+        for rec in self._records.by_owner(resource_id):
+            self._remove(rec, changes)
+        del self._ingresses[resource_id]
+        await self._notify_subscribers(changes)
+
+    async def sweep_ingresses(
+        self, seen: typing.Set[str], namespace: str | None = None
+    ):
+        """
+        Remove the ingresses which are not among those seen, along with their records, as one
+        change. Given a namespace, only the ingresses within it are swept
+        """
+        changes = ChangeSet()
+        for resource_id in set(self._ingresses) - seen:
+            if namespace is not None and not resource_id.startswith(f"{namespace}/"):
+                continue
+            for rec in self._records.by_owner(resource_id):
+                self._remove(rec, changes)
             del self._ingresses[resource_id]
-        await self._notify_subscribers()
+            self._logger.info("Swept ingress %s", resource_id)
+        await self._notify_subscribers(changes)
+
+    def _ingress_records(
+        self, ingress: kubernetes_asyncio.client.V1Ingress
+    ) -> typing.Set[Record]:
+        """
+        Derive the records of an ingress from the distinct hosts of all its rules and TLS
+        sections, on each of its load balancer addresses
+        """
+        resource_id = f"{ingress.metadata.namespace}/{ingress.metadata.name}"
+        hosts = {rule.host for rule in ingress.spec.rules or [] if rule.host}
+        for tls in ingress.spec.tls or []:
+            hosts.update(host for host in tls.hosts or [] if host)
+        load_balancer = ingress.status.load_balancer if ingress.status else None
+        addresses = [
+            lb.ip
+            for lb in (load_balancer.ingress if load_balancer else None) or []
+            if lb.ip is not None
+        ]
+        if len(addresses) == 0:
+            self._logger.warning(
+                "Skipping ingress %s because it has no load_balancer IP injected yet",
+                resource_id,
+            )
+            return set()
+        return {
+            Record(owner_id=resource_id, hostname=host, ip_address=ip_address, port=80)
+            for host in hosts
+            for ip_address in addresses
+        }
 
     def records(self, domain: str | None = None) -> typing.Set[Record]:
         if domain is None:
-            return self._records
-        return set(filter(lambda r: r.fqdn.endswith(domain), self._records))
+            return self._records.all()
+        return self._records.by_domain(domain)
+
+    def sizes(self) -> typing.Dict[str, int]:
+        """
+        Return the number of objects known to the registry by kind
+        """
+        return {
+            "gateways": len(self._gateways),
+            "routes": len(self._routes),
+            "ingresses": len(self._ingresses),
+            "records": len(self._records),
+        }
+
+    def domain_sizes(self) -> typing.Dict[str, int]:
+        """
+        Return the number of records by domain
+        """
+        return dict(collections.Counter(rec.domain for rec in self._records))
 
     def clear(self):
         self._records.clear()
         self._gateways.clear()
         self._routes.clear()
+        self._routes_by_gateway.clear()
         self._ingresses.clear()
 
     def subscribe(self, ns: BaseNameserver):
-        self._subscribers.add(ns)
+        """
+        Subscribe a nameserver to the changes of the records within its zone, or to all changes
+        when it has no zone
+        """
+        self._zones[labels(ns.zone or "")].add(ns)
+
+    async def reconcile(self):
+        """
+        Have every subscriber reconcile what it publishes with the full set of records
+        """
+        await self.flush()
+        async with self._publishing_lock:
+            if not self.publishing:
+                return
+            for zone, subscribers in self._zones.items():
+                records = (
+                    self._records.all()
+                    if zone == ()
+                    else self._records.by_domain_labels(zone)
+                )
+                for subscriber in subscribers:
+                    await subscriber.update(records)
+
+    async def start_publishing(self):
+        """
+        Publish all records, such as when becoming the leader, and every change from now on
+        """
+        self.publishing = True
+        await self.reconcile()
+
+    async def stop_publishing(self):
+        """
+        Stop publishing changes and have the subscribers withdraw what they published, such
+        as when another replica becomes the leader
+        """
+        async with self._publishing_lock:
+            self.publishing = False
+            for subscribers in self._zones.values():
+                for subscriber in subscribers:
+                    await subscriber.withdraw()
+
+    def _add(self, record: Record, changes: ChangeSet):
+        if self._records.add(record):
+            changes.add(record)
+
+    def _remove(self, record: Record, changes: ChangeSet):
+        if self._records.remove(record):
+            changes.remove(record)
+
+    async def flush(self):
+        """
+        Deliver any changes still held back by the notification scheduler
+        """
+        await self._scheduler.flush()
+
+    async def _notify_subscribers(self, changes: ChangeSet):
+        with metrics.NOTIFY_SECONDS.time():
+            await self._scheduler.schedule(changes)
+
+    async def _deliver(self, changes: ChangeSet):
+        async with self._publishing_lock:
+            if not self.publishing:
+                return
+            with metrics.DELIVER_SECONDS.time():
+                for zone, zone_changes in self._partition(changes).items():
+                    for subscriber in self._zones[zone]:
+                        await subscriber.apply(zone_changes)
+
+    def _partition(
+        self, changes: ChangeSet
+    ) -> typing.Dict[typing.Tuple[str, ...], ChangeSet]:
+        """
+        Split the changes by the zones subscribed to. Subscribers without a zone receive all
+        changes
+        """
+        partitions: typing.Dict[typing.Tuple[str, ...], ChangeSet] = {}
+        if () in self._zones:
+            partitions[()] = changes
+        if len(self._zones) == len(partitions):
+            return partitions
+        for rec in changes.removed:
+            for zone in self._zones_of(rec):
+                partitions.setdefault(zone, ChangeSet()).remove(rec)
+        # Modified records keep their hostname, so they stay within the same zones
+        for current, rec in changes.modified:
+            for zone in self._zones_of(rec):
+                partitions.setdefault(zone, ChangeSet()).remove(current)
+                partitions[zone].add(rec)
+        for rec in changes.added:
+            for zone in self._zones_of(rec):
+                partitions.setdefault(zone, ChangeSet()).add(rec)
+        return partitions
+
+    def _zones_of(self, rec: Record) -> typing.Iterator[typing.Tuple[str, ...]]:
+        """
+        Yield the zones other than the root subscribed to which the record belongs
+        """
+        name = labels(rec.fqdn)
+        for depth in range(1, len(name) + 1):
+            if name[:depth] in self._zones:
+                yield name[:depth]
+
+
+class RegistryReconciler(BaseTask):
+    """
+    Periodically reconciles the nameservers with the full set of records in the registry,
+    catching anything the change sets may have missed. It only starts once the watchers
+    have listed their resources
+    """
+
+    def __init__(
+        self,
+        registry: Registry,
+        interval: float,
+        watchers: typing.Sequence[BaseWatcher] = (),
+    ) -> None:
+        super().__init__()
+        self._registry = registry
+        self._interval = interval
+        self._watchers = watchers
 
-    async def _notify_subscribers(self):
-        records = self.records()
-        for subscriber in self._subscribers:
-            await subscriber.update(records)
+    async def run(self):
+        await BaseWatcher.wait_synced(self._watchers)
+        while not self._should_stop:
+            await asyncio.sleep(self._interval)
+            try:
+                await self._registry.reconcile()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                self._logger.exception("Failed to reconcile the nameservers")
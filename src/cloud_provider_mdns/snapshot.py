@@ -0,0 +1,155 @@
+#  MIT License
+#
+#  Copyright (c)  2025 Mathieu Imfeld
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#  OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#  SOFTWARE.
+
+
+import os
+import gzip
+import json
+import typing
+import asyncio
+import pathlib
+import hashlib
+
+from cloud_provider_mdns.base import BaseTask, BaseWatcher, BaseNameserver, Record
+from cloud_provider_mdns.registry import Registry
+
+
+class Snapshotter(BaseTask):
+    """
+    Periodically writes the records published by the nameservers to a compressed snapshot
+    file, so that a restarted process takes them as published rather than publishing every
+    record anew. Once every watcher has listed its resources, the nameservers are reconciled
+    with the registry, which only publishes what changed while we were not running.
+    The registry itself is not snapshotted since the lists rebuild it anyway
+    """
+
+    version = 1
+
+    def __init__(
+        self,
+        registry: Registry,
+        nameservers: typing.Sequence[BaseNameserver],
+        watchers: typing.Sequence[BaseWatcher],
+        path: pathlib.Path,
+        interval: float = 60,
+    ) -> None:
+        super().__init__()
+        self._registry = registry
+        self._nameservers = [ns for ns in nameservers if ns.snapshot_key is not None]
+        self._watchers = watchers
+        self._path = path
+        self._interval = interval
+        self._digest: bytes | None = None
+
+    async def run(self):
+        await BaseWatcher.wait_synced(self._watchers)
+        self._logger.info("Reconciling the nameservers with the listed resources")
+        await self._registry.reconcile()
+        while not self._should_stop:
+            await asyncio.sleep(self._interval)
+            try:
+                await asyncio.to_thread(self._write, self.dump())
+            except OSError as e:
+                self._logger.warning(f"Failed to write snapshot {self._path}: {e}")
+
+    def restore(self) -> int:
+        """
+        Restore the records published by the nameservers from the snapshot, returns how many
+        """
+        try:
+            with gzip.open(self._path, "rt", encoding="utf-8") as f:
+                snapshot = json.load(f)
+            if snapshot.get("version") != self.version:
+                self._logger.warning(
+                    f"Ignoring snapshot {self._path} of version {snapshot.get('version')}"
+                )
+                return 0
+            restored = {
+                ns: {
+                    Record(
+                        owner_id=owner_id,
+                        hostname=hostname,
+                        ip_address=ip_address,
+                        gateway_id=gateway_id,
+                        port=port,
+                    )
+                    for owner_id, hostname, ip_address, gateway_id, port in snapshot[
+                        "nameservers"
+                    ].get(ns.snapshot_key, [])
+                }
+                for ns in self._nameservers
+            }
+        except FileNotFoundError:
+            self._logger.info(f"No snapshot at {self._path}, publishing all records")
+            return 0
+        except (OSError, EOFError, ValueError, KeyError, TypeError) as e:
+            self._logger.warning(f"Ignoring unreadable snapshot {self._path}: {e}")
+            return 0
+        for ns, records in restored.items():
+            ns.restore(records)
+        count = sum(len(records) for records in restored.values())
+        self._logger.info(f"Restored {count} published records from {self._path}")
+        return count
+
+    def dump(self) -> bytes:
+        """
+        Serialise the records published by the nameservers
+        """
+        snapshot = {
+            "version": self.version,
+            "nameservers": {
+                ns.snapshot_key: sorted(
+                    (
+                        rec.owner_id,
+                        rec.hostname,
+                        rec.ip_address,
+                        rec.gateway_id,
+                        rec.port,
+                    )
+                    for rec in ns.registered()
+                )
+                for ns in self._nameservers
+            },
+        }
+        return json.dumps(snapshot, separators=(",", ":")).encode("utf-8")
+
+    def save(self):
+        """
+        Write the snapshot now, such as when shutting down
+        """
+        self._write(self.dump())
+
+    def _write(self, payload: bytes):
+        """
+        Atomically replace the snapshot, unless nothing changed since it was last written
+        """
+        digest = hashlib.sha256(payload).digest()
+        if digest == self._digest:
+            return
+        partial = self._path.with_name(f".{self._path.name}.tmp")
+        with open(partial, "wb") as f:
+            f.write(gzip.compress(payload, compresslevel=6, mtime=0))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(partial, self._path)
+        self._digest = digest
+        self._logger.debug(f"Wrote snapshot {self._path}")
@@ -20,15 +20,11 @@
 #  OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 #  SOFTWARE.
 
-import asyncio
+import typing
 
-import aiohttp.client_exceptions
 import kubernetes_asyncio as kubernetes  # type: ignore[import-untyped]
-import pydantic
 
 from cloud_provider_mdns.base import (
-    GatewayNotReadyException,
-    UnidentifiableResourceException,
     BaseWatcher,
     Record,
     HTTPRoute,
@@ -38,215 +34,376 @@ from cloud_provider_mdns.base import (
 )
 from cloud_provider_mdns.registry import Registry
 
+Selector = typing.FrozenSet[typing.Tuple[str, str]]
+
 
 class IngressWatcher(BaseWatcher):
-    def __init__(self, registry: Registry):
-        super().__init__(registry)
+    kind = "Ingresses"
+
+    def __init__(self, registry: Registry, **kwargs):
+        super().__init__(registry, **kwargs)
         self._api = kubernetes.client.NetworkingV1Api()
 
-    async def run(self):
-        self._logger.info("Watching for Ingresses")
-        try:
-            while True:
-                async for event in self._watch.stream(
-                    self._api.list_ingress_for_all_namespaces
-                ):
-                    ingress = event["object"]
-                    if (
-                        ingress.status.load_balancer.ingress is None
-                        or ingress.status.load_balancer.ingress[0].ip is None
-                    ):
-                        self._logger.warning(
-                            f"Skipping ingress {ingress.metadata.name}/{ingress.metadata.namespace} because it has no load_balancer IP injected yet"
-                        )
-                        continue
-                    if len(ingress.status.load_balancer.ingress) > 1:
-                        self._logger.warning(
-                            f"Skipping Ingress {ingress.metadata.name}/{ingress.metadata.namespace} has multiple load_balancer ingress IPs injected. "
-                            f"Only the first one will be used."
-                        )
-                    record = Record(
-                        owner_id=f"{ingress.metadata.namespace}/{ingress.metadata.name}",
-                        hostname=ingress.spec.rules[0].host,
-                        ip_address=ingress.status.load_balancer.ingress[0].ip,
-                        port=80,
-                    )
-                    await self.register_record(event["type"], record)
-        except UnidentifiableResourceException as ur:
-            self._logger.warning(ur)
-        except GatewayNotReadyException as gnre:
-            self._logger.warning(gnre)
-        except kubernetes.client.exceptions.ApiException:
-            self._logger.info("Kubernetes API error, restarting")
-        except aiohttp.client_exceptions.ClientError as ce:
-            self._logger.info(f"Client error while connecting to Kubernetes API: {ce}")
-        except asyncio.CancelledError:
-            self._logger.info("Stopping")
-            self._should_stop = True
-            await self._watch.close()
-            raise
+    def list_call(self):
+        if self._namespace is None:
+            return self._api.list_ingress_for_all_namespaces, (), self.selectors()
+        return self._api.list_namespaced_ingress, (self._namespace,), self.selectors()
+
+    async def handle(self, event_type: str, ingress: kubernetes.client.V1Ingress):
+        match event_type:
+            case "ADDED" | "MODIFIED":
+                await self._registry.add_ingress(ingress)
+            case "DELETED":
+                await self._registry.remove_ingress(ingress)
+
+    async def sweep(self, seen: typing.Set[str]):
+        await self._registry.sweep_ingresses(seen, namespace=self._namespace)
+
+
+class IstioCache:
+    """
+    In-memory caches of native Istio Gateways and the Services of type LoadBalancer exposing
+    them, both indexed by selector. Listeners are told which Gateways are affected by a change
+    """
+
+    def __init__(self) -> None:
+        self._gateways: typing.Dict[str, NativeIstioGateway] = {}
+        self._services: typing.Dict[str, kubernetes.client.V1Service] = {}
+        self._gateways_by_selector: typing.Dict[Selector, typing.Set[str]] = {}
+        self._services_by_selector: typing.Dict[Selector, typing.Set[str]] = {}
+        self._listeners: typing.List[
+            typing.Callable[[typing.Set[str]], typing.Awaitable[None]]
+        ] = []
+
+    def subscribe(
+        self, listener: typing.Callable[[typing.Set[str]], typing.Awaitable[None]]
+    ):
+        self._listeners.append(listener)
+
+    async def set_gateway(self, gateway: NativeIstioGateway):
+        gateway_id = f"{gateway.metadata.namespace}/{gateway.metadata.name}"
+        self._unindex_gateway(gateway_id)
+        self._gateways[gateway_id] = gateway
+        self._gateways_by_selector.setdefault(
+            self._selector(gateway.spec.selector), set()
+        ).add(gateway_id)
+        await self._notify({gateway_id})
+
+    async def remove_gateway(self, gateway: NativeIstioGateway):
+        gateway_id = f"{gateway.metadata.namespace}/{gateway.metadata.name}"
+        self._unindex_gateway(gateway_id)
+        await self._notify({gateway_id})
+
+    async def set_service(self, service: kubernetes.client.V1Service):
+        service_id = f"{service.metadata.namespace}/{service.metadata.name}"
+        affected = self._unindex_service(service_id)
+        selector = self._selector(service.spec.selector)
+        self._services[service_id] = service
+        self._services_by_selector.setdefault(selector, set()).add(service_id)
+        affected.update(self._gateways_by_selector.get(selector, set()))
+        await self._notify(affected)
+
+    async def remove_service(self, service: kubernetes.client.V1Service):
+        service_id = f"{service.metadata.namespace}/{service.metadata.name}"
+        await self._notify(self._unindex_service(service_id))
+
+    async def sweep_gateways(self, seen: typing.Set[str]):
+        """
+        Remove the Gateways which are not among those seen, notifying the listeners once
+        """
+        stale = set(self._gateways) - seen
+        for gateway_id in stale:
+            self._unindex_gateway(gateway_id)
+        await self._notify(stale)
+
+    async def sweep_services(self, seen: typing.Set[str]):
+        """
+        Remove the Services which are not among those seen, notifying the listeners once
+        """
+        affected: typing.Set[str] = set()
+        for service_id in set(self._services) - seen:
+            affected.update(self._unindex_service(service_id))
+        await self._notify(affected)
+
+    def addresses(self, gateway_id: str) -> typing.List[str]:
+        """
+        Return all load balancer IP addresses of the first Service exposing the Gateway, which
+        are both its IPv4 and IPv6 addresses when it is dual-stack
+        """
+        gateway = self._gateways.get(gateway_id)
+        if gateway is None:
+            return []
+        selector = self._selector(gateway.spec.selector)
+        for service_id in sorted(self._services_by_selector.get(selector, set())):
+            ingress = self._services[service_id].status.load_balancer.ingress or []
+            addresses = [lb.ip for lb in ingress if lb.ip is not None]
+            if len(addresses) > 0:
+                return addresses
+        return []
+
+    def _unindex_gateway(self, gateway_id: str):
+        gateway = self._gateways.pop(gateway_id, None)
+        if gateway is None:
+            return
+        selector = self._selector(gateway.spec.selector)
+        self._gateways_by_selector[selector].discard(gateway_id)
+        if len(self._gateways_by_selector[selector]) == 0:
+            del self._gateways_by_selector[selector]
+
+    def _unindex_service(self, service_id: str) -> typing.Set[str]:
+        """
+        Remove a Service from the cache, returning the Gateways it exposed
+        """
+        service = self._services.pop(service_id, None)
+        if service is None:
+            return set()
+        selector = self._selector(service.spec.selector)
+        self._services_by_selector[selector].discard(service_id)
+        if len(self._services_by_selector[selector]) == 0:
+            del self._services_by_selector[selector]
+        return set(self._gateways_by_selector.get(selector, set()))
+
+    async def _notify(self, gateway_ids: typing.Set[str]):
+        if len(gateway_ids) == 0:
+            return
+        for listener in self._listeners:
+            await listener(gateway_ids)
+
+    @staticmethod
+    def _selector(selector: typing.Dict[str, str] | None) -> Selector:
+        return frozenset((selector or {}).items())
+
+
+class IstioGatewayWatcher(BaseWatcher):
+    """
+    Keeps the native Istio Gateways in the IstioCache up to date
+    """
+
+    kind = "Istio Gateways"
+    required_api_name = "networking.istio.io"
+
+    def __init__(self, registry: Registry, cache: IstioCache, **kwargs):
+        super().__init__(registry, **kwargs)
+        self._api = kubernetes.client.CustomObjectsApi()
+        self._cache = cache
+
+    def list_call(self):
+        return self._list_custom_objects("networking.istio.io", "v1", "gateways")
+
+    async def handle(self, event_type: str, obj: typing.Dict[str, typing.Any]):
+        gateway = NativeIstioGateway.model_validate(obj)
+        match event_type:
+            case "ADDED" | "MODIFIED":
+                await self._cache.set_gateway(gateway)
+            case "DELETED":
+                await self._cache.remove_gateway(gateway)
+
+    async def sweep(self, seen: typing.Set[str]):
+        await self._cache.sweep_gateways(seen)
+
+
+class LoadBalancerServiceWatcher(BaseWatcher):
+    """
+    Keeps the Services of type LoadBalancer in the IstioCache up to date
+    """
+
+    kind = "Services of type LoadBalancer"
+    required_api_name = "networking.istio.io"
+
+    def __init__(self, registry: Registry, cache: IstioCache, **kwargs):
+        super().__init__(registry, **kwargs)
+        self._api = kubernetes.client.CoreV1Api()
+        self._cache = cache
+
+    def list_call(self):
+        return (
+            self._api.list_service_for_all_namespaces,
+            (),
+            self.selectors("spec.type=LoadBalancer"),
+        )
+
+    async def handle(self, event_type: str, service: kubernetes.client.V1Service):
+        match event_type:
+            case "ADDED" | "MODIFIED":
+                await self._cache.set_service(service)
+            case "DELETED":
+                await self._cache.remove_service(service)
+
+    async def sweep(self, seen: typing.Set[str]):
+        await self._cache.sweep_services(seen)
 
 
 class VirtualServiceWatcher(BaseWatcher):
-    def __init__(self, registry: Registry):
-        super().__init__(registry)
+    """
+    Resolves VirtualServices to the load balancer IP address of their Gateway from the
+    IstioCache, and re-resolves them whenever the cache tells us their Gateway changed
+    """
+
+    kind = "VirtualServices"
+    required_api_name = "networking.istio.io"
+
+    def __init__(self, registry: Registry, cache: IstioCache, **kwargs):
+        super().__init__(registry, **kwargs)
         self._api = kubernetes.client.CustomObjectsApi()
-        self._core_api = kubernetes.client.CoreV1Api()
+        self._cache = cache
+        self._cache.subscribe(self._on_gateways_changed)
+        self._virtualservices: typing.Dict[str, VirtualService] = {}
+        self._gateway_ids: typing.Dict[str, str] = {}
+        self._by_gateway: typing.Dict[str, typing.Set[str]] = {}
+        self._records: typing.Dict[str, typing.Set[Record]] = {}
 
-    async def run(self):
-        if not await self._has_api(required_api_name="networking.istio.io"):
+    def list_call(self):
+        return self._list_custom_objects("networking.istio.io", "v1", "virtualservices")
+
+    async def handle(self, event_type: str, obj: typing.Dict[str, typing.Any]):
+        virtualservice = VirtualService.model_validate(obj)
+        resource_id = (
+            f"{virtualservice.metadata.namespace}/{virtualservice.metadata.name}"
+        )
+        self._forget(resource_id)
+        if event_type == "DELETED":
+            await self._publish(resource_id, set())
+            return
+        # Filter out the mesh gateway, if present
+        gateways = list(filter(lambda g: g != "mesh", virtualservice.spec.gateways))
+        if len(gateways) > 1:
+            self._logger.warning(
+                "VirtualService %s has multiple gateways configured. Only the first one will be used.",
+                resource_id,
+            )
+        if len(gateways) == 0:
             self._logger.warning(
-                "Not watching for VirtualServices because the cluster you are connected to does not know them"
+                "Skipping VirtualService %s because it has no gateways configured",
+                resource_id,
             )
+            await self._publish(resource_id, set())
             return
-        self._logger.info("Watching for VirtualServices")
-        try:
-            while True:
-                async for event in self._watch.stream(
-                    self._api.list_cluster_custom_object,
-                    "networking.istio.io",
-                    "v1",
-                    "virtualservices",
-                ):
-                    virtualservice = VirtualService.model_validate(event["object"])
-                    # Filter out the mesh gateway, if present
-                    gateways = list(
-                        filter(lambda g: g != "mesh", virtualservice.spec.gateways)
-                    )
-                    if len(gateways) > 1:
-                        self._logger.warning(
-                            f"VirtualService {virtualservice.metadata.name}/{virtualservice.metadata.namespace} has multiple gateways configured. Only the first one will be used."
-                        )
-                    if len(gateways) == 0:
-                        self._logger.warning(
-                            f"Skipping VirtualService {virtualservice.metadata.name}/{virtualservice.metadata.namespace} because it has no gateways configured"
-                        )
-                        continue
-                    # The gateway namespace may be different from the virtualservice namespace
-                    if "/" in gateways[0]:
-                        gw_ns, gw_name = gateways[0].split("/")
-                    else:
-                        gw_ns = virtualservice.metadata.namespace
-                        gw_name = gateways[0]
-                    # Look up the gateway
-                    gw_raw = await self._api.get_namespaced_custom_object(
-                        group="networking.istio.io",
-                        version="v1",
-                        namespace=gw_ns,
-                        plural="gateways",
-                        name=gw_name,
-                    )
-                    gw = NativeIstioGateway.model_validate(gw_raw)
-                    # Find all Services of type LoadBalancer and filter them on the selector of our gateway
-                    lb_svcs = await self._core_api.list_service_for_all_namespaces(
-                        field_selector="spec.type=LoadBalancer"
-                    )
-                    lb_svc = list(
-                        filter(
-                            lambda s: s.spec.selector == gw.spec.selector,
-                            lb_svcs.items,
-                        )
-                    )
-                    if len(lb_svc) == 0:
-                        self._logger.warning(
-                            f"Skipping VirtualService {virtualservice.metadata.name}/{virtualservice.metadata.namespace} because no exposed service can be resolved for it"
-                        )
-                        continue
-                    record = Record(
-                        owner_id=f"{virtualservice.metadata.namespace}/{virtualservice.metadata.name}",
-                        hostname=virtualservice.spec.hosts[0],
-                        ip_address=lb_svc[0].status.load_balancer.ingress[0].ip,
-                        port=80,
-                    )
-                    await self.register_record(event["type"], record)
-        except UnidentifiableResourceException as ur:
-            self._logger.warning(ur)
-        except GatewayNotReadyException as gnre:
-            self._logger.warning(gnre)
-        except kubernetes.client.exceptions.ApiException as ae:
-            self._logger.info("Kubernetes API error, restarting")
-        except aiohttp.client_exceptions.ClientError as ce:
-            self._logger.info(f"Client error while connecting to Kubernetes API: {ce}")
-        except asyncio.CancelledError:
-            self._logger.info("Stopping")
-            self._should_stop = True
-            await self._watch.close()
-            raise
+        # The gateway namespace may be different from the virtualservice namespace
+        if "/" in gateways[0]:
+            gw_ns, gw_name = gateways[0].split("/")
+        else:
+            gw_ns = virtualservice.metadata.namespace
+            gw_name = gateways[0]
+        gateway_id = f"{gw_ns}/{gw_name}"
+        self._virtualservices[resource_id] = virtualservice
+        self._gateway_ids[resource_id] = gateway_id
+        self._by_gateway.setdefault(gateway_id, set()).add(resource_id)
+        await self._resolve(resource_id)
+
+    async def sweep(self, seen: typing.Set[str]):
+        for resource_id in (set(self._virtualservices) | set(self._records)) - seen:
+            self._forget(resource_id)
+            self._records.pop(resource_id, None)
+        await super().sweep(seen)
+
+    async def _on_gateways_changed(self, gateway_ids: typing.Set[str]):
+        for gateway_id in gateway_ids:
+            for resource_id in list(self._by_gateway.get(gateway_id, set())):
+                await self._resolve(resource_id)
+
+    async def _resolve(self, resource_id: str):
+        # The VirtualService may have been deleted meanwhile by one of our workers
+        virtualservice = self._virtualservices.get(resource_id)
+        if virtualservice is None:
+            return
+        addresses = self._cache.addresses(self._gateway_ids[resource_id])
+        if len(addresses) == 0:
+            self._logger.warning(
+                "Skipping VirtualService %s because no exposed service can be resolved for it",
+                resource_id,
+            )
+            await self._publish(resource_id, set())
+            return
+        records = {
+            Record(
+                owner_id=resource_id,
+                hostname=virtualservice.spec.hosts[0],
+                ip_address=ip_address,
+                port=80,
+            )
+            for ip_address in addresses
+        }
+        await self._publish(resource_id, records)
+
+    async def _publish(self, resource_id: str, records: typing.Set[Record]):
+        """
+        Register the records of a VirtualService, replacing those registered before
+        """
+        current = self._records.pop(resource_id, set())
+        if len(records) > 0:
+            self._records[resource_id] = records
+        if current == records:
+            return
+        await self.register_records(
+            "MODIFIED" if len(records) > 0 else "DELETED", resource_id, records
+        )
+
+    def _forget(self, resource_id: str):
+        self._virtualservices.pop(resource_id, None)
+        gateway_id = self._gateway_ids.pop(resource_id, None)
+        if gateway_id is not None:
+            self._by_gateway[gateway_id].discard(resource_id)
+            if len(self._by_gateway[gateway_id]) == 0:
+                del self._by_gateway[gateway_id]
+
+
+class GatewayWatcher(BaseWatcher):
+    """
+    Keeps the Gateways known to the registry up to date, so HTTPRoutes resolve their
+    Gateways from memory and have their records re-derived when a Gateway changes
+    """
+
+    kind = "Gateways"
+    required_api_name = "gateway.networking.k8s.io"
+
+    def __init__(self, registry: Registry, **kwargs):
+        super().__init__(registry, **kwargs)
+        self._api = kubernetes.client.CustomObjectsApi()
+
+    def list_call(self):
+        return self._list_custom_objects("gateway.networking.k8s.io", "v1", "gateways")
+
+    async def handle(self, event_type: str, obj: typing.Dict[str, typing.Any]):
+        gateway = KubernetesGateway.model_validate(obj)
+        match event_type:
+            case "ADDED" | "MODIFIED":
+                await self._registry.add_gateway(gateway)
+            case "DELETED":
+                await self._registry.remove_gateway(gateway)
+
+    async def sweep(self, seen: typing.Set[str]):
+        await self._registry.sweep_gateways(seen)
 
 
 class HTTPRouteWatcher(BaseWatcher):
-    def __init__(self, registry: Registry):
-        super().__init__(registry)
+    """
+    Hands HTTPRoutes to the registry, which derives their records from the Gateways
+    maintained by the GatewayWatcher
+    """
+
+    kind = "HTTPRoutes"
+    required_api_name = "gateway.networking.k8s.io"
+
+    def __init__(self, registry: Registry, **kwargs):
+        super().__init__(registry, **kwargs)
         self._api = kubernetes.client.CustomObjectsApi()
 
-    async def run(self):
-        if not await self._has_api(required_api_name="gateway.networking.k8s.io"):
+    def list_call(self):
+        return self._list_custom_objects(
+            "gateway.networking.k8s.io", "v1", "httproutes"
+        )
+
+    async def handle(self, event_type: str, obj: typing.Dict[str, typing.Any]):
+        httproute = HTTPRoute.model_validate(obj)
+        if event_type == "DELETED":
+            await self._registry.remove_route(httproute)
+            return
+        if len(httproute.status.parents) == 0:
             self._logger.warning(
-                "Not watching for HTTPRoutes because the cluster you are connected to does not know them"
+                "Skipping HTTPRoute %s because it has no parents (yet)", str(httproute)
             )
             return
-        self._logger.info("Watching for HTTPRoutes")
-        try:
-            while True:
-                async for event in self._watch.stream(
-                    self._api.list_cluster_custom_object,
-                    "gateway.networking.k8s.io",
-                    "v1",
-                    "httproutes",
-                ):
-                    if "status" not in event["object"]:
-                        self._logger.warning(
-                            f"Skipping HTTPRoute {event['object']['metadata']['name']}/{event['object']['metadata']['namespace']} because it has no status yet"
-                        )
-                        continue
-                    if "parents" not in event["object"]["status"]:
-                        self._logger.warning(
-                            f"Skipping HTTPRoute {event['object']['metadata']['name']}/{event['object']['metadata']['namespace']} because it has no parents"
-                        )
-                    httproute = HTTPRoute.model_validate(event["object"])
-                    if len(httproute.status.parents) == 0:
-                        self._logger.warning(
-                            f"Skipping HTTPRoute {httproute.metadata.name}/{httproute.metadata.namespace} because it has no parents (yet)"
-                        )
-                        continue
-                    if len(httproute.status.parents) > 1:
-                        self._logger.warning(
-                            f"HTTPRoute {httproute.metadata.name}/{httproute.metadata.namespace} has multiple gateways configured. Only the first one will be used."
-                        )
-                    gw_ns = httproute.status.parents[0].parentRef.namespace
-                    gw_name = httproute.status.parents[0].parentRef.name
-                    # Look up the gateway
-                    gw_raw = await self._api.get_namespaced_custom_object(
-                        group="gateway.networking.k8s.io",
-                        version="v1",
-                        namespace=gw_ns,
-                        plural="gateways",
-                        name=gw_name,
-                    )
-                    gw = KubernetesGateway.model_validate(gw_raw)
-                    if len(gw.status.addresses) > 1:
-                        self._logger.warning(
-                            f"Gateway {gw_ns}/{gw} has multiple IP addresses configured. Only the first one will be used."
-                        )
-                    record = Record(
-                        owner_id=f"{httproute.metadata.namespace}/{httproute.metadata.name}",
-                        hostname=httproute.spec.hostnames[0],
-                        ip_address=gw.status.addresses[0].value,
-                        port=80,
-                    )
-                    await self.register_record(event["type"], record)
-        except UnidentifiableResourceException as ur:
-            self._logger.warning(ur)
-        except GatewayNotReadyException as gnre:
-            self._logger.warning(gnre)
-        except pydantic.ValidationError as ve:
-            self._logger.info("Unable to parse object")
-        except kubernetes.client.exceptions.ApiException:
-            self._logger.info("Kubernetes API error, restarting")
-        except aiohttp.client_exceptions.ClientError as ce:
-            self._logger.info(f"Client error while connecting to Kubernetes API: {ce}")
-        except asyncio.CancelledError:
-            self._logger.info("Stopping")
-            self._should_stop = True
-            await self._watch.close()
-            raise
+        await self._registry.add_route(httproute)
+
+    async def sweep(self, seen: typing.Set[str]):
+        await self._registry.sweep_routes(seen, namespace=self._namespace)
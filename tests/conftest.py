@@ -21,9 +21,14 @@
 #  SOFTWARE.
 
 import typing
+import asyncio
 
 import pytest
+import pytest_asyncio
 import pydantic
+import dns.message
+import dns.rcode
+import zeroconf
 
 from cloud_provider_mdns.base import (
     KubernetesGateway,
@@ -36,6 +41,7 @@ from cloud_provider_mdns.base import (
     Condition,
     BaseNameserver,
     Record,
+    ChangeSet,
     KubernetesGatewaySpec,
     KubernetesGatewayListenerSpec,
     KubernetesGatewayStatus,
@@ -44,6 +50,37 @@ from cloud_provider_mdns.base import (
 from cloud_provider_mdns.registry import Registry
 
 
+class RecordingNameserver(BaseNameserver):
+    """
+    A nameserver that merely records the changes it is asked to publish
+    """
+
+    def __init__(self, registry: Registry, **kwargs) -> None:
+        super().__init__(registry, **kwargs)
+        self.changes: typing.List[ChangeSet] = []
+        self.published: typing.Set[Record] = set()
+
+    def registered(self) -> typing.Set[Record]:
+        return set(self.published)
+
+    async def apply(self, changes: ChangeSet):
+        self.changes.append(changes)
+        await super().apply(changes)
+
+    async def add(self, rec: Record):
+        self.published.add(rec)
+
+    async def modify(self, current: Record, rec: Record):
+        self.published.discard(current)
+        self.published.add(rec)
+
+    async def remove(self, rec: Record):
+        self.published.discard(rec)
+
+    async def withdraw(self):
+        self.published.clear()
+
+
 @pytest.fixture(scope="function")
 def registry():
     registry = Registry()
@@ -52,6 +89,11 @@ def registry():
     registry.clear()
 
 
+@pytest.fixture(scope="function")
+def nameserver(registry):
+    return RecordingNameserver(registry)
+
+
 @pytest.fixture(scope="function")
 def gateway(registry):
     return KubernetesGateway(
@@ -92,3 +134,111 @@ def route():
             ]
         ),
     )
+
+
+class FakeDNSServer:
+    """
+    A DNS server on localhost which accepts every DNS UPDATE message it receives over TCP
+    """
+
+    def __init__(self) -> None:
+        self.port = 0
+        self.connections = 0
+        self.updates: typing.List[dns.message.Message] = []
+        self.rcode = dns.rcode.NOERROR
+        self.refused: typing.Set[str] = set()
+        self._server: asyncio.Server | None = None
+        self._writers: typing.List[asyncio.StreamWriter] = []
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, "127.0.0.1", 0)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        self.close_connections()
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+
+    def close_connections(self):
+        for writer in self._writers:
+            writer.close()
+        self._writers.clear()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.connections += 1
+        self._writers.append(writer)
+        try:
+            while True:
+                length = int.from_bytes(await reader.readexactly(2), "big")
+                message = dns.message.from_wire(await reader.readexactly(length))
+                self.updates.append(message)
+                response = dns.message.make_response(message)
+                if any(
+                    rrset.name.to_text() in self.refused for rrset in message.update
+                ):
+                    response.set_rcode(dns.rcode.REFUSED)
+                else:
+                    response.set_rcode(self.rcode)
+                wire = response.to_wire()
+                writer.write(len(wire).to_bytes(2, "big") + wire)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            writer.close()
+
+
+@pytest_asyncio.fixture(scope="function", loop_scope="function")
+async def dns_server():
+    server = FakeDNSServer()
+    await server.start()
+    yield server
+    await server.stop()
+
+
+class FakeAsyncZeroconf:
+    """
+    Stands in for zeroconf.asyncio.AsyncZeroconf and records the services it is asked to
+    register, update and unregister
+    """
+
+    def __init__(self, *args, **kwargs) -> None:
+        self.registered: typing.Dict[str, typing.Any] = {}
+        self.registrations = 0
+        self.updates = 0
+        self.unregistrations = 0
+        self.delay = 0.0
+        self.in_flight: typing.Set[str] = set()
+        self.max_in_flight = 0
+
+    async def async_register_service(self, info, allow_name_change=False, **kwargs):
+        # Registering the same name concurrently would defeat the conflict detection
+        assert info.name not in self.in_flight
+        self.in_flight.add(info.name)
+        self.max_in_flight = max(self.max_in_flight, len(self.in_flight))
+        await asyncio.sleep(self.delay)
+        self.in_flight.remove(info.name)
+        if info.name in self.registered:
+            if not allow_name_change:
+                raise zeroconf.ServiceNameAlreadyRegistered
+            info.name = f"{info.name.split('.')[0]}-2.{info.type}"
+        self.registrations += 1
+        self.registered[info.name] = info
+
+    async def async_update_service(self, info):
+        self.updates += 1
+
+    async def async_unregister_service(self, info):
+        self.unregistrations += 1
+        self.registered.pop(info.name, None)
+
+    async def async_unregister_all_services(self):
+        self.registered.clear()
+
+    async def async_close(self):
+        pass
+
+
+@pytest.fixture(scope="function")
+def aiozc(monkeypatch):
+    monkeypatch.setattr("zeroconf.asyncio.AsyncZeroconf", FakeAsyncZeroconf)
+    return FakeAsyncZeroconf
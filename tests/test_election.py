@@ -0,0 +1,171 @@
+#  MIT License
+#
+#  Copyright (c)  2025 Mathieu Imfeld
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#  OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#  SOFTWARE.
+
+
+import copy
+import asyncio
+
+import pytest
+import kubernetes_asyncio as kubernetes  # type: ignore[import-untyped]
+
+from conftest import RecordingNameserver
+from cloud_provider_mdns.base import Record
+from cloud_provider_mdns.registry import Registry
+from cloud_provider_mdns.election import LeaderElector
+
+
+class FakeCoordinationApi:
+    """
+    Keeps a single Lease like the API server, rejecting updates made to an outdated version
+    """
+
+    def __init__(self) -> None:
+        self.lease: kubernetes.client.V1Lease | None = None
+        self.version = 0
+
+    async def read_namespaced_lease(self, name: str, namespace: str):
+        if self.lease is None:
+            raise kubernetes.client.exceptions.ApiException(status=404)
+        return copy.deepcopy(self.lease)
+
+    async def create_namespaced_lease(self, namespace: str, body):
+        if self.lease is not None:
+            raise kubernetes.client.exceptions.ApiException(status=409)
+        self._store(body)
+
+    async def replace_namespaced_lease(self, name: str, namespace: str, body):
+        if body.metadata.resource_version != str(self.version):
+            raise kubernetes.client.exceptions.ApiException(status=409)
+        self._store(body)
+
+    def _store(self, lease: kubernetes.client.V1Lease):
+        self.version += 1
+        lease.metadata.resource_version = str(self.version)
+        self.lease = copy.deepcopy(lease)
+
+
+def replica(api: FakeCoordinationApi, identity: str):
+    registry = Registry(publishing=False)
+    nameserver = RecordingNameserver(registry)
+    elector = LeaderElector(
+        registry, identity, lease_duration=0.3, renew_deadline=0.2, retry_period=0.02
+    )
+    elector._api = api
+    return registry, nameserver, elector
+
+
+async def wait_for(condition, timeout: float = 2):
+    async with asyncio.timeout(timeout):
+        while not condition():
+            await asyncio.sleep(0.01)
+
+
+@pytest.mark.asyncio
+async def test_leader_election_failover():
+    """
+    This test verifies that only the leader publishes the records both replicas know about,
+    and that the standby takes over once the leader releases the lease
+    """
+    api = FakeCoordinationApi()
+    record = Record(owner_id="app/one", hostname="one.local", ip_address="172.18.0.2")
+    leader_registry, leader_ns, leader = replica(api, "one")
+    standby_registry, standby_ns, standby = replica(api, "two")
+    for registry in (leader_registry, standby_registry):
+        await registry.add_record(record)
+
+    leader_task = asyncio.create_task(leader.run())
+    await wait_for(lambda: leader.leading)
+    standby_task = asyncio.create_task(standby.run())
+    await asyncio.sleep(0.1)
+    assert leader_ns.published == {record}
+    assert not standby.leading
+    assert standby_ns.published == set()
+    assert len(standby_registry.records()) == 1
+
+    leader_task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await leader_task
+    await wait_for(lambda: standby.leading, timeout=0.25)
+    assert standby_ns.published == {record}
+    assert api.lease.spec.holder_identity == "two"
+    assert api.lease.spec.lease_transitions == 1
+    standby_task.cancel()
+
+
+@pytest.mark.asyncio
+async def test_leader_stands_by_when_lease_is_lost():
+    """
+    This test verifies that a leader failing to renew the lease within the renew deadline
+    stops publishing and withdraws its records
+    """
+    api = FakeCoordinationApi()
+    registry, nameserver, elector = replica(api, "one")
+    await registry.add_record(
+        Record(owner_id="app/one", hostname="one.local", ip_address="172.18.0.2")
+    )
+    task = asyncio.create_task(elector.run())
+    await wait_for(lambda: elector.leading)
+    assert len(nameserver.published) == 1
+
+    # Another replica took over, such as while we were partitioned from the API server
+    api.lease.spec.holder_identity = "two"
+    api.version += 1
+    api.lease.metadata.resource_version = str(api.version)
+    await wait_for(lambda: not elector.leading)
+    assert nameserver.published == set()
+    assert not registry.publishing
+    task.cancel()
+
+
+class UnsyncedWatcher:
+    """
+    Stands in for a watcher that has not listed its resources yet
+    """
+
+    def __init__(self) -> None:
+        self.synced = asyncio.Event()
+
+
+@pytest.mark.asyncio
+async def test_leader_publishes_once_watchers_synced():
+    """
+    This test verifies that a new leader does not reconcile before its watchers have listed
+    their resources, which would remove the records restored from a snapshot meanwhile
+    """
+    api = FakeCoordinationApi()
+    registry, nameserver, elector = replica(api, "one")
+    record = Record(owner_id="app/one", hostname="one.local", ip_address="172.18.0.2")
+    nameserver.published = {record}
+    watcher = UnsyncedWatcher()
+    elector._watchers = [watcher]
+    task = asyncio.create_task(elector.run())
+    await wait_for(lambda: elector.leading)
+    await asyncio.sleep(0.05)
+    assert nameserver.published == {record}
+    assert not registry.publishing
+
+    await registry.add_record(record)
+    watcher.synced.set()
+    await wait_for(lambda: registry.publishing)
+    assert nameserver.published == {record}
+    assert nameserver.changes == []
+    task.cancel()
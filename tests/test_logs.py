@@ -0,0 +1,105 @@
+#  MIT License
+#
+#  Copyright (c)  2025 Mathieu Imfeld
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#  OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#  SOFTWARE.
+
+
+import json
+import logging
+
+from cloud_provider_mdns.logs import JsonFormatter, RateLimitFilter, StatusFormatter
+
+
+def warning(msg: str, *args) -> logging.LogRecord:
+    return logging.LogRecord("Registry", logging.WARNING, __file__, 1, msg, args, None)
+
+
+def test_rate_limit_repeated_warnings(monkeypatch):
+    """
+    This test verifies that a repeated warning is let through once per interval, reporting
+    how many repeats were suppressed, while the same warning about another resource and
+    messages below WARNING are not limited
+    """
+    now = 1000.0
+    monkeypatch.setattr("cloud_provider_mdns.logs.time.monotonic", lambda: now)
+    limit = RateLimitFilter(interval=60)
+    unknown = "%s specifies gateway %s but it is not (yet) known"
+    assert limit.filter(warning(unknown, "app/route", "edge/gw"))
+    assert not limit.filter(warning(unknown, "app/route", "edge/gw"))
+    assert not limit.filter(warning(unknown, "app/route", "edge/gw"))
+    assert limit.filter(warning(unknown, "app/other", "edge/gw"))
+    info = warning(unknown, "app/route", "edge/gw")
+    info.levelno = logging.INFO
+    assert limit.filter(info)
+
+    now += 60
+    record = warning(unknown, "app/route", "edge/gw")
+    assert limit.filter(record)
+    assert record.suppressed == 2
+    assert (
+        record.getMessage()
+        == "app/route specifies gateway edge/gw but it is not (yet) known (suppressed 2 times)"
+    )
+
+
+def test_json_formatter():
+    """
+    This test verifies that log records are formatted as single JSON lines
+    """
+    line = JsonFormatter().format(warning("%s is not a known gateway", "edge/gw"))
+    entry = json.loads(line)
+    assert entry["level"] == "WARNING"
+    assert entry["logger"] == "Registry"
+    assert entry["message"] == "edge/gw is not a known gateway"
+
+
+def test_rate_limit_evicts_oldest_warnings():
+    """
+    This test verifies that a flood of distinct warnings beyond the number of remembered
+    keys evicts the oldest ones rather than growing or rebuilding the filter
+    """
+    limit = RateLimitFilter(interval=60)
+    limit.max_keys = 100
+    unknown = "%s specifies gateway %s but it is not (yet) known"
+    for i in range(1000):
+        assert limit.filter(warning(unknown, f"app/route{i}", "edge/gw"))
+    assert len(limit._seen) == 100
+    assert not limit.filter(warning(unknown, "app/route999", "edge/gw"))
+    # The oldest warning was forgotten, so it is logged again
+    assert limit.filter(warning(unknown, "app/route0", "edge/gw"))
+
+
+def test_status_is_not_part_of_the_rate_limit_key():
+    """
+    This test verifies that the status logged along with a warning does not make a repeat
+    unique, while it is still part of the formatted line
+    """
+    limit = RateLimitFilter(interval=60)
+    records = []
+    for failed_events in (1, 2):
+        record = warning("Failed to handle %s event: %s", "ADDED", "boom")
+        record.status = f"failed_events={failed_events}"
+        records.append(record)
+    assert limit.filter(records[0])
+    assert not limit.filter(records[1])
+    assert StatusFormatter("%(message)s").format(records[0]) == (
+        "Failed to handle ADDED event: boom (failed_events=1)"
+    )
+    assert json.loads(JsonFormatter().format(records[0]))["status"] == "failed_events=1"
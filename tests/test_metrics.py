@@ -0,0 +1,104 @@
+#  MIT License
+#
+#  Copyright (c)  2025 Mathieu Imfeld
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#  OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#  SOFTWARE.
+
+
+import asyncio
+
+import pytest
+
+from cloud_provider_mdns.metrics import Histogram, MetricsServer
+from cloud_provider_mdns.watchers import HTTPRouteWatcher
+from cloud_provider_mdns.nameservers import UnicastNameserver
+
+
+def test_histogram_buckets():
+    """
+    This test verifies that a histogram renders cumulative buckets, the sum and the count of
+    the observed values by their labels
+    """
+    histogram = Histogram("test_seconds", "Test", ("operation",))
+    histogram.buckets = (0.1, 1)
+    for value in (0.05, 0.1, 0.5, 2):
+        histogram.observe(value, operation="register")
+    lines = list(histogram.collect().render())
+    assert lines == [
+        "# HELP test_seconds Test",
+        "# TYPE test_seconds histogram",
+        'test_seconds_bucket{operation="register",le="0.1"} 2',
+        'test_seconds_bucket{operation="register",le="1.0"} 3',
+        'test_seconds_bucket{operation="register",le="+Inf"} 4',
+        'test_seconds_sum{operation="register"} 2.65',
+        'test_seconds_count{operation="register"} 4',
+    ]
+
+
+async def scrape(port: int, path: str) -> str:
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(f"GET {path} HTTP/1.1\r\nHost: localhost\r\n\r\n".encode())
+    response = await reader.read()
+    writer.close()
+    return response.decode()
+
+
+@pytest.mark.asyncio
+async def test_metrics_endpoint(registry, gateway, route):
+    """
+    This test verifies that the metrics endpoint reports the state of the registry, the
+    watchers and the nameservers, and nothing else
+    """
+    await registry.add_gateway(gateway)
+    await registry.add_route(route)
+    watcher = HTTPRouteWatcher(registry, namespace="app")
+    watcher.events["ADDED"] = 2
+    watcher.restarts = 1
+    nameserver = UnicastNameserver(registry, domain="k8s")
+    nameserver.suppressed_updates = 3
+    server = MetricsServer(registry, [watcher], [nameserver], port=0)
+    task = asyncio.create_task(server.run())
+    try:
+        while server.port == 0:
+            await asyncio.sleep(0.01)
+        response = await scrape(server.port, "/metrics")
+        assert response.startswith("HTTP/1.1 200 OK")
+        body = response.split("\r\n\r\n", 1)[1].splitlines()
+        assert (
+            'cloud_provider_mdns_watch_events_total{watcher="HTTPRouteWatcher",namespace="app",type="ADDED"} 2'
+            in body
+        )
+        assert (
+            'cloud_provider_mdns_watch_restarts_total{watcher="HTTPRouteWatcher",namespace="app"} 1'
+            in body
+        )
+        assert 'cloud_provider_mdns_registry_objects{kind="routes"} 1' in body
+        assert 'cloud_provider_mdns_registry_records{domain="local"} 1' in body
+        assert "# TYPE cloud_provider_mdns_registry_notify_seconds histogram" in body
+        assert (
+            "# TYPE cloud_provider_mdns_registry_notify_merged_events histogram" in body
+        )
+        assert (
+            'cloud_provider_mdns_unicast_suppressed_updates_total{zone="k8s."} 3'
+            in body
+        )
+
+        assert (await scrape(server.port, "/")).startswith("HTTP/1.1 404 Not Found")
+    finally:
+        task.cancel()
@@ -0,0 +1,272 @@
+#  MIT License
+#
+#  Copyright (c)  2025 Mathieu Imfeld
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#  OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#  SOFTWARE.
+
+import typing
+
+import pytest
+import dns.rdataclass
+import dns.rdatatype
+
+from cloud_provider_mdns.base import Record
+from cloud_provider_mdns.nameservers import MulticastNameserver, UnicastNameserver
+from cloud_provider_mdns.registry import Registry
+
+
+@pytest.mark.asyncio
+async def test_unicast_reuses_connection(registry, dns_server):
+    """
+    This test verifies that DNS UPDATE messages are sent over a single persistent connection,
+    and that the connection is re-established when the nameserver closes it
+    """
+    ns = UnicastNameserver(registry, ip="127.0.0.1", port=dns_server.port, domain="k8s")
+    await registry.add_record(
+        Record(owner_id="app/one", hostname="one.k8s", ip_address="172.18.0.2")
+    )
+    await registry.add_record(
+        Record(owner_id="app/two", hostname="two.k8s", ip_address="172.18.0.3")
+    )
+    assert len(dns_server.updates) == 2
+    assert dns_server.connections == 1
+    assert ns.registered() == registry.records()
+
+    dns_server.close_connections()
+    await registry.add_record(
+        Record(owner_id="app/three", hostname="three.k8s", ip_address="172.18.0.4")
+    )
+    assert len(dns_server.updates) == 3
+    assert dns_server.connections == 2
+    assert ns.registered() == registry.records()
+    await ns.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_unicast_batches_changes(dns_server):
+    """
+    This test verifies that the changes of a single registry update are sent in as few
+    DNS UPDATE messages as the batch size permits, and that a rejected batch is split
+    until the offending record is found
+    """
+    registry = Registry(notify_window=10)
+    ns = UnicastNameserver(
+        registry, ip="127.0.0.1", port=dns_server.port, domain="k8s", batch_size=4
+    )
+    for i in range(8):
+        await registry.add_record(
+            Record(owner_id=f"app/{i}", hostname=f"app{i}.k8s", ip_address="172.18.0.2")
+        )
+    await registry.flush()
+    assert len(dns_server.updates) == 2
+    assert ns.registered() == registry.records()
+
+    dns_server.updates.clear()
+    dns_server.refused.add("bad.k8s.")
+    await registry.add_record(
+        Record(owner_id="app/bad", hostname="bad.k8s", ip_address="172.18.0.3")
+    )
+    for i in range(8, 10):
+        await registry.add_record(
+            Record(owner_id=f"app/{i}", hostname=f"app{i}.k8s", ip_address="172.18.0.2")
+        )
+    await registry.remove_record(
+        Record(owner_id="app/0", hostname="app0.k8s", ip_address="172.18.0.2")
+    )
+    await registry.flush()
+    # The rejected batch is split until the bad record is sent on its own
+    assert len(dns_server.updates) >= 5
+    assert {r.hostname for r in ns.registered()} == {
+        f"app{i}.k8s" for i in range(1, 10)
+    }
+    await ns.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_unicast_suppresses_unchanged(registry, dns_server):
+    """
+    This test verifies that a full reconciliation does not re-send records whose address,
+    port and TTL have not changed since they were last pushed
+    """
+    ns = UnicastNameserver(registry, ip="127.0.0.1", port=dns_server.port, domain="k8s")
+    one = Record(owner_id="app/one", hostname="one.k8s", ip_address="172.18.0.2")
+    await registry.add_record(one)
+    await registry.add_record(
+        Record(owner_id="app/two", hostname="two.k8s", ip_address="172.18.0.3")
+    )
+    assert len(dns_server.updates) == 2
+    await registry.reconcile()
+    assert len(dns_server.updates) == 2
+    assert ns.suppressed_updates == 2
+
+    await registry.modify_record(
+        Record(owner_id="app/one", hostname="one.k8s", ip_address="172.18.0.4")
+    )
+    assert len(dns_server.updates) == 3
+    await registry.remove_record(
+        Record(owner_id="app/one", hostname="one.k8s", ip_address="172.18.0.4")
+    )
+    await registry.add_record(one)
+    assert len(dns_server.updates) == 5
+    assert ns.registered() == registry.records()
+    await ns.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_unicast_owner_swap(dns_server):
+    """
+    This test verifies that a record handed over to another owner within the same change
+    set keeps its address published, rather than being deleted with its previous owner
+    """
+    registry = Registry(notify_window=60)
+    ns = UnicastNameserver(registry, ip="127.0.0.1", port=dns_server.port, domain="k8s")
+    one = Record(owner_id="app/one", hostname="one.k8s", ip_address="172.18.0.2")
+    await registry.add_record(one)
+    await registry.flush()
+    await registry.remove_record(one)
+    await registry.add_record(
+        Record(owner_id="app/other", hostname="one.k8s", ip_address="172.18.0.2")
+    )
+    await registry.flush()
+    # The name keeps the same address, so there is nothing to send
+    assert len(dns_server.updates) == 1
+    assert ns._published["one.k8s."] == {"A": frozenset({"172.18.0.2"})}
+    assert ns.registered() == registry.records()
+    await ns.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_unicast_publishes_all_addresses(registry, dns_server):
+    """
+    This test verifies that all addresses of a name are published together as its A and
+    AAAA RRsets, and that removing the last IPv6 address deletes the AAAA RRset
+    """
+    ns = UnicastNameserver(registry, ip="127.0.0.1", port=dns_server.port, domain="k8s")
+    records = {
+        Record(owner_id="app/one", hostname="one.k8s", ip_address=ip_address)
+        for ip_address in ["172.18.0.2", "172.18.0.3", "fd00::2"]
+    }
+    await registry.replace_records("app/one", records)
+    assert len(dns_server.updates) == 1
+    rrsets: typing.Dict[str, typing.Set[str]] = {}
+    for rrset in dns_server.updates[-1].update:
+        if rrset.deleting is None:
+            rrsets.setdefault(dns.rdatatype.to_text(rrset.rdtype), set()).update(
+                rdata.address for rdata in rrset
+            )
+    assert rrsets == {"A": {"172.18.0.2", "172.18.0.3"}, "AAAA": {"fd00::2"}}
+
+    await registry.replace_records(
+        "app/one", {r for r in records if r.ip_address != "fd00::2"}
+    )
+    assert len(dns_server.updates) == 2
+    deleted = [
+        rrset
+        for rrset in dns_server.updates[-1].update
+        if rrset.deleting == dns.rdataclass.ANY
+    ]
+    assert sorted(dns.rdatatype.to_text(rrset.rdtype) for rrset in deleted) == [
+        "A",
+        "AAAA",
+    ]
+    assert not any(
+        rrset.deleting is None and rrset.rdtype == dns.rdatatype.AAAA
+        for rrset in dns_server.updates[-1].update
+    )
+    assert ns.registered() == registry.records()
+    await ns.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_multicast_avoids_unchanged_announcements(registry, aiozc):
+    """
+    This test verifies that services are only re-announced when their port or address
+    actually changed
+    """
+    ns = MulticastNameserver(registry)
+    one = Record(owner_id="app/one", hostname="one.local", ip_address="172.18.0.2")
+    await registry.add_record(one)
+    await registry.add_record(
+        Record(owner_id="app/two", hostname="two.local", ip_address="172.18.0.3")
+    )
+    assert ns._aiozc.registrations == 2
+    await registry.reconcile()
+    assert ns._aiozc.updates == 0
+    assert ns.avoided_announcements == 2
+
+    await registry.modify_record(
+        Record(owner_id="app/one", hostname="one.local", ip_address="172.18.0.4")
+    )
+    assert ns._aiozc.updates == 1
+    assert ns.registered() == registry.records()
+    await ns.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_multicast_registers_concurrently(aiozc):
+    """
+    This test verifies that services are registered concurrently up to the configured limit,
+    while registrations of the same service name still happen one after the other so the
+    second one is renamed
+    """
+    registry = Registry(notify_window=10)
+    ns = MulticastNameserver(registry, max_concurrency=4)
+    ns._aiozc.delay = 0.01
+    for i in range(10):
+        await registry.add_record(
+            Record(
+                owner_id=f"app/{i}", hostname=f"app{i}.local", ip_address="172.18.0.2"
+            )
+        )
+    await registry.add_record(
+        Record(owner_id="app/dup", hostname="app0.local", ip_address="172.18.0.3")
+    )
+    await registry.flush()
+    assert ns._aiozc.max_in_flight == 4
+    assert ns._aiozc.registrations == 11
+    assert len(ns._aiozc.registered) == 11
+    assert ns.registered() == registry.records()
+    await ns.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_multicast_publishes_all_addresses(registry, aiozc):
+    """
+    This test verifies that all addresses of an owner for a name are published within a
+    single service, which is only unregistered once its last address is removed
+    """
+    ns = MulticastNameserver(registry)
+    records = {
+        Record(owner_id="app/one", hostname="one.local", ip_address=ip_address)
+        for ip_address in ["172.18.0.2", "fd00::2"]
+    }
+    await registry.replace_records("app/one", records)
+    assert ns._aiozc.registrations == 1
+    (info,) = ns._aiozc.registered.values()
+    assert set(info.parsed_addresses()) == {"172.18.0.2", "fd00::2"}
+
+    await registry.replace_records(
+        "app/one", {r for r in records if r.ip_address == "fd00::2"}
+    )
+    assert info.parsed_addresses() == ["fd00::2"]
+    assert ns._aiozc.unregistrations == 0
+    await registry.replace_records("app/one", set())
+    assert ns._aiozc.unregistrations == 1
+    assert ns.registered() == registry.records()
+    await ns.shutdown()
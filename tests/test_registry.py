@@ -20,9 +20,16 @@
 #  OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 #  SOFTWARE.
 
+import typing
+import asyncio
+
 import pytest
+import kubernetes_asyncio as kubernetes  # type: ignore[import-untyped]
+
+from cloud_provider_mdns.base import ParentReference, Record
+from cloud_provider_mdns.registry import Registry, RegistryReconciler
 
-from cloud_provider_mdns.base import ParentReference
+from conftest import RecordingNameserver
 
 
 @pytest.mark.asyncio
@@ -128,3 +135,279 @@ async def test_route_many2many(registry, gateway, route):
 
     await registry.remove_gateway(gw1)
     assert len(registry.records()) == 2
+
+
+@pytest.mark.asyncio
+async def test_registry_records_by_domain(registry, gateway, route):
+    """
+    This test verifies that records can be looked up by the domain they end in, regardless
+    of whether the hostname is fully qualified and across routes sharing a top-level domain
+    """
+    app1 = route.model_copy(deep=True)
+    app1.metadata.name = "app1"
+    app1.spec.hostnames = ["app1.local", "app1.test.org", "app1.kube-eng.k8s."]
+    app2 = route.model_copy(deep=True)
+    app2.metadata.name = "app2"
+    app2.spec.hostnames = ["app2.other.org"]
+
+    await registry.add_gateway(gateway)
+    await registry.add_route(app1)
+    await registry.add_route(app2)
+    assert {r.hostname for r in registry.records(".local.")} == {"app1.local"}
+    assert {r.hostname for r in registry.records("test.org.")} == {"app1.test.org"}
+    assert len(registry.records("org.")) == 2
+    assert {r.hostname for r in registry.records("kube-eng.k8s.")} == {
+        "app1.kube-eng.k8s."
+    }
+    assert len(registry.records(".")) == 4
+
+
+@pytest.mark.asyncio
+async def test_registry_modify_record(registry):
+    """
+    This test verifies that modifying a record replaces the record with the same owner and
+    hostname, and that a record for an unknown owner and hostname is added instead
+    """
+    await registry.add_record(
+        Record(owner_id="app/ing", hostname="ing.local", ip_address="172.18.0.2")
+    )
+    await registry.add_record(
+        Record(owner_id="app/other", hostname="ing.local", ip_address="172.18.0.3")
+    )
+    await registry.modify_record(
+        Record(owner_id="app/ing", hostname="ing.local", ip_address="172.18.0.4")
+    )
+    assert {r.ip_address for r in registry.records()} == {"172.18.0.3", "172.18.0.4"}
+    await registry.modify_record(
+        Record(owner_id="app/new", hostname="new.local", ip_address="172.18.0.5")
+    )
+    assert len(registry.records()) == 3
+    await registry.remove_record(
+        Record(owner_id="app/ing", hostname="ing.local", ip_address="172.18.0.4")
+    )
+    assert {r.owner_id for r in registry.records("local.")} == {"app/other", "app/new"}
+
+
+@pytest.mark.asyncio
+async def test_registry_notifies_changes(registry, nameserver, gateway, route):
+    """
+    This test verifies that subscribers are only handed the records that changed with each
+    mutation of the registry, and that mutations without effect do not notify them at all
+    """
+    await registry.add_gateway(gateway)
+    assert len(nameserver.changes) == 0
+    await registry.add_route(route)
+    assert len(nameserver.changes) == 1
+    assert {r.hostname for r in nameserver.changes[-1].added} == {"app.local"}
+
+    rec = next(iter(registry.records()))
+    moved = Record(
+        owner_id=rec.owner_id,
+        hostname=rec.hostname,
+        ip_address="172.18.0.3",
+        gateway_id=rec.gateway_id,
+    )
+    await registry.modify_record(moved)
+    assert len(nameserver.changes) == 2
+    assert nameserver.changes[-1].modified == [(rec, moved)]
+    assert len(nameserver.changes[-1].added) == 0
+    assert len(nameserver.changes[-1].removed) == 0
+    await registry.modify_record(moved)
+    assert len(nameserver.changes) == 2
+
+    await registry.remove_route(route)
+    assert nameserver.changes[-1].removed == {moved}
+    assert nameserver.published == set()
+
+
+@pytest.mark.asyncio
+async def test_registry_modify_gateway_minimal_delta(
+    registry, nameserver, gateway, route
+):
+    """
+    This test verifies that modifying a gateway only re-derives the records of the routes
+    attached to it, notifying the subscribers once with just the records that changed
+    """
+    other = route.model_copy(deep=True)
+    other.metadata.name = "elsewhere"
+    other.spec.hostnames = ["elsewhere.local"]
+    other.spec.parentRefs[0].name = "other-gw"
+    await registry.add_route(route)
+    await registry.add_route(other)
+    await registry.add_gateway(gateway)
+    assert {r.hostname for r in registry.records()} == {"app.local"}
+    assert len(nameserver.changes) == 1
+
+    # Nothing changes for the route when an unrelated listener is added
+    gateway.spec.listeners.append(
+        gateway.spec.listeners[0].model_copy(update={"name": "h"})
+    )
+    await registry.modify_gateway(gateway)
+    assert len(nameserver.changes) == 1
+
+    rec = next(iter(registry.records()))
+    gateway.status.addresses[0].value = "172.18.0.3"
+    await registry.modify_gateway(gateway)
+    assert len(nameserver.changes) == 2
+    assert [
+        (current, new.ip_address) for current, new in nameserver.changes[-1].modified
+    ] == [(rec, "172.18.0.3")]
+    assert len(nameserver.changes[-1].added) == 0
+    assert len(nameserver.changes[-1].removed) == 0
+    assert registry._routes_by_gateway["edge/gw"] == {"app/app-route"}
+
+    await registry.remove_route(route)
+    assert "edge/gw" not in registry._routes_by_gateway
+
+
+def ingress(hosts: typing.List[str], tls_hosts: typing.List[str]):
+    client = kubernetes.client
+    return client.V1Ingress(
+        metadata=client.V1ObjectMeta(name="web", namespace="app"),
+        spec=client.V1IngressSpec(
+            rules=[client.V1IngressRule(host=host) for host in hosts]
+            + [client.V1IngressRule()],
+            tls=[client.V1IngressTLS(hosts=tls_hosts)],
+        ),
+        status=client.V1IngressStatus(
+            load_balancer=client.V1IngressLoadBalancerStatus(
+                ingress=[
+                    client.V1IngressLoadBalancerIngress(ip="172.18.0.2"),
+                    client.V1IngressLoadBalancerIngress(ip="fd00::2"),
+                ]
+            )
+        ),
+    )
+
+
+@pytest.mark.asyncio
+async def test_registry_ingress_fan_out(registry, nameserver):
+    """
+    This test verifies that an ingress publishes every distinct host of its rules and TLS
+    sections on all of its addresses, and that modifying it only touches the hosts that changed
+    """
+    await registry.add_ingress(
+        ingress(["a.local", "b.local"], ["b.local", "secure.local"])
+    )
+    assert {(r.hostname, r.ip_address) for r in registry.records()} == {
+        (host, ip_address)
+        for host in ["a.local", "b.local", "secure.local"]
+        for ip_address in ["172.18.0.2", "fd00::2"]
+    }
+    assert len(nameserver.changes) == 1
+
+    await registry.modify_ingress(ingress(["a.local", "c.local"], ["secure.local"]))
+    assert len(nameserver.changes) == 2
+    assert {r.hostname for r in nameserver.changes[-1].removed} == {"b.local"}
+    assert {r.hostname for r in nameserver.changes[-1].added} == {"c.local"}
+    assert len(nameserver.changes[-1].modified) == 0
+
+    await registry.remove_ingress(ingress([], []))
+    assert len(registry.records()) == 0
+    assert nameserver.published == set()
+
+
+@pytest.mark.asyncio
+async def test_registry_reconcile(registry, nameserver, gateway, route):
+    """
+    This test verifies that a full reconciliation publishes missing records and withdraws
+    records that are no longer in the registry
+    """
+    stale = Record(owner_id="app/gone", hostname="gone.local", ip_address="172.18.0.9")
+    nameserver.published.add(stale)
+    await registry.add_gateway(gateway)
+    await registry.add_route(route)
+    nameserver.published.clear()
+    nameserver.published.add(stale)
+    await registry.reconcile()
+    assert nameserver.published == registry.records()
+
+
+@pytest.mark.asyncio
+async def test_registry_partitions_changes_by_zone(registry, nameserver):
+    """
+    This test verifies that nameservers subscribed to a zone only receive and reconcile the
+    records within their zone, while those without a zone receive all of them
+    """
+    k8s = RecordingNameserver(registry, zone="k8s")
+    eng = RecordingNameserver(registry, zone="eng.k8s.")
+    for hostname in ["app.local", "app.k8s", "app.eng.k8s", "app.fook8s"]:
+        await registry.add_record(
+            Record(owner_id=f"app/{hostname}", hostname=hostname, ip_address="10.0.0.1")
+        )
+    assert {r.hostname for r in k8s.published} == {"app.k8s", "app.eng.k8s"}
+    assert {r.hostname for r in eng.published} == {"app.eng.k8s"}
+    assert len(nameserver.published) == 4
+    assert len(eng.changes) == 1
+
+    await registry.modify_record(
+        Record(
+            owner_id="app/app.eng.k8s", hostname="app.eng.k8s", ip_address="10.0.0.2"
+        )
+    )
+    assert len(eng.changes[-1].modified) == 1
+    assert {r.ip_address for r in k8s.published} == {"10.0.0.1", "10.0.0.2"}
+
+    eng.published.clear()
+    await registry.reconcile()
+    assert {r.hostname for r in eng.published} == {"app.eng.k8s"}
+    assert registry.records("eng.k8s.") == eng.published
+
+
+@pytest.mark.asyncio
+async def test_reconciler_survives_failure(registry, monkeypatch):
+    """
+    This test verifies that a failing reconciliation is logged and retried at the next
+    interval rather than ending the reconciler
+    """
+    reconciler = RegistryReconciler(registry, interval=0)
+    attempts = []
+
+    async def reconcile():
+        attempts.append(True)
+        if len(attempts) == 1:
+            raise RuntimeError("Nameserver unavailable")
+        reconciler._should_stop = True
+
+    monkeypatch.setattr(registry, "reconcile", reconcile)
+    await asyncio.wait_for(reconciler.run(), timeout=1)
+    assert len(attempts) == 2
+
+
+@pytest.mark.asyncio
+async def test_registry_coalesces_notifications(gateway, route):
+    """
+    This test verifies that mutations within the notification window are delivered to the
+    subscribers as a single change set, and that reaching the maximum number of pending
+    changes delivers them early
+    """
+    registry = Registry(notify_window=0.05, notify_max_changes=3)
+    nameserver = RecordingNameserver(registry)
+    await registry.add_gateway(gateway)
+    for name in ["app1", "app2"]:
+        app = route.model_copy(deep=True)
+        app.metadata.name = name
+        app.spec.hostnames = [f"{name}.local"]
+        await registry.add_route(app)
+    assert len(nameserver.changes) == 0
+    await asyncio.sleep(0.1)
+    assert len(nameserver.changes) == 1
+    assert len(nameserver.changes[0].added) == 2
+    assert registry._scheduler.last_merged_events == 2
+
+    app3 = route.model_copy(deep=True)
+    app3.metadata.name = "app3"
+    app3.spec.hostnames = ["app3.local", "app3.test.org", "app3.kube-eng.k8s."]
+    await registry.add_route(app3)
+    assert len(nameserver.changes) == 2
+    assert len(nameserver.published) == 5
+
+    await registry.add_record(
+        Record(owner_id="app/ing", hostname="ing.local", ip_address="172.18.0.4")
+    )
+    await registry.remove_record(
+        Record(owner_id="app/ing", hostname="ing.local", ip_address="172.18.0.4")
+    )
+    await registry.flush()
+    assert len(nameserver.changes) == 2
+    assert registry._scheduler.last_merged_events == 2
@@ -0,0 +1,78 @@
+#  MIT License
+#
+#  Copyright (c)  2025 Mathieu Imfeld
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#  OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#  SOFTWARE.
+
+
+import pytest
+
+from cloud_provider_mdns.base import Record
+from cloud_provider_mdns.registry import Registry
+from cloud_provider_mdns.nameservers import UnicastNameserver
+from cloud_provider_mdns.snapshot import Snapshotter
+
+
+@pytest.mark.asyncio
+async def test_snapshot_warm_restart(dns_server, tmp_path):
+    """
+    This test verifies that a restarted process takes the records of a snapshot as published,
+    so that only the changes made while it was not running are sent to the nameserver
+    """
+    one = Record(owner_id="app/one", hostname="one.k8s", ip_address="172.18.0.2")
+    two = Record(owner_id="app/two", hostname="two.k8s", ip_address="172.18.0.3")
+    path = tmp_path / "snapshot.json.gz"
+    registry = Registry()
+    ns = UnicastNameserver(registry, ip="127.0.0.1", port=dns_server.port, domain="k8s")
+    await registry.add_record(one)
+    await registry.add_record(two)
+    Snapshotter(registry, [ns], [], path=path).save()
+    await ns.shutdown()
+    assert len(dns_server.updates) == 2
+
+    # Meanwhile, two was deleted and three was added
+    registry = Registry()
+    ns = UnicastNameserver(registry, ip="127.0.0.1", port=dns_server.port, domain="k8s")
+    snapshotter = Snapshotter(registry, [ns], [], path=path, interval=0)
+    assert snapshotter.restore() == 2
+    await registry.add_record(one)
+    assert len(dns_server.updates) == 2
+    await registry.add_record(
+        Record(owner_id="app/three", hostname="three.k8s", ip_address="172.18.0.4")
+    )
+    assert len(dns_server.updates) == 3
+
+    snapshotter._should_stop = True
+    await snapshotter.run()
+    assert len(dns_server.updates) == 4
+    assert dns_server.updates[-1].update[0].name.to_text() == "two.k8s."
+    assert ns.registered() == registry.records()
+    await ns.shutdown()
+
+
+def test_snapshot_unreadable(registry, tmp_path):
+    """
+    This test verifies that a missing or unreadable snapshot is ignored
+    """
+    ns = UnicastNameserver(registry, domain="k8s")
+    path = tmp_path / "snapshot.json.gz"
+    assert Snapshotter(registry, [ns], [], path=path).restore() == 0
+    path.write_bytes(b"not a snapshot")
+    assert Snapshotter(registry, [ns], [], path=path).restore() == 0
+    assert ns.registered() == set()
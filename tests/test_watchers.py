@@ -0,0 +1,453 @@
+#  MIT License
+#
+#  Copyright (c)  2025 Mathieu Imfeld
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#  OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#  SOFTWARE.
+
+import typing
+import asyncio
+
+import aiohttp
+import pytest
+import kubernetes_asyncio as kubernetes  # type: ignore[import-untyped]
+
+from cloud_provider_mdns import base
+from cloud_provider_mdns.base import BaseWatcher, HTTPRoute
+from cloud_provider_mdns.watchers import (
+    GatewayWatcher,
+    HTTPRouteWatcher,
+    IstioCache,
+    IstioGatewayWatcher,
+    LoadBalancerServiceWatcher,
+    VirtualServiceWatcher,
+)
+
+
+class FakeWatch:
+    """
+    Streams a fixed list of events, then stops the watcher and fails like a broken
+    connection to the API server
+    """
+
+    def __init__(self, events: typing.List[typing.Dict], watcher: BaseWatcher) -> None:
+        self._events = list(events)
+        self._watcher = watcher
+        self.resource_version: str | None = None
+        self.streamed_from: typing.List[str | None] = []
+
+    def stream(self, func, *args, **kwargs):
+        self.resource_version = kwargs.get("resource_version")
+        self.streamed_from.append(self.resource_version)
+        return self._stream()
+
+    async def _stream(self):
+        while len(self._events) > 0:
+            event = self._events.pop(0)
+            if isinstance(event, Exception):
+                raise event
+            obj = event["object"]
+            if isinstance(obj, dict):
+                self.resource_version = obj["metadata"].get(
+                    "resourceVersion", self.resource_version
+                )
+            yield event
+        self._watcher._should_stop = True
+        raise kubernetes.client.exceptions.ApiException(status=500)
+
+    async def close(self):
+        pass
+
+
+class FakeApi:
+    """
+    Answers every list call with the same list of custom objects
+    """
+
+    def __init__(self, items: typing.List[typing.Dict], resource_version: str) -> None:
+        self.items = items
+        self.resource_version = resource_version
+        self.lists = 0
+        self.calls: typing.List[typing.Tuple[str, typing.Tuple, typing.Dict]] = []
+
+    def __getattr__(self, name: str):
+        async def list_objects(*args, **kwargs):
+            self.lists += 1
+            self.calls.append((name, args, kwargs))
+            return {
+                "items": self.items,
+                "metadata": {"resourceVersion": self.resource_version},
+            }
+
+        return list_objects
+
+
+async def run_watcher(
+    watcher_class, registry, monkeypatch, events, *args, items=(), **kwargs
+):
+    async def has_api(required_api_name: str) -> bool:
+        return True
+
+    watcher = watcher_class(registry, *args, **kwargs)
+    monkeypatch.setattr(watcher, "_has_api", has_api)
+    watcher.backoff_min = watcher.backoff_max = 0
+    watcher._api = FakeApi(list(items), "1")
+    watcher._watch = FakeWatch(events, watcher)
+    await watcher.run()
+    return watcher
+
+
+@pytest.mark.asyncio
+async def test_httproute_resolves_gateway_from_registry(
+    registry, monkeypatch, gateway, route
+):
+    """
+    This test verifies that HTTPRoutes are resolved against the Gateways maintained by the
+    GatewayWatcher, and that their records follow the addresses of the Gateway
+    """
+    await run_watcher(
+        HTTPRouteWatcher,
+        registry,
+        monkeypatch,
+        [{"type": "ADDED", "object": route.model_dump()}],
+    )
+    assert len(registry.records()) == 0
+
+    moved = gateway.model_copy(deep=True)
+    moved.status.addresses[0].value = "172.18.0.3"
+    await run_watcher(
+        GatewayWatcher,
+        registry,
+        monkeypatch,
+        [
+            {"type": "ADDED", "object": gateway.model_dump()},
+            {"type": "MODIFIED", "object": moved.model_dump()},
+        ],
+    )
+    assert {r.ip_address for r in registry.records()} == {"172.18.0.3"}
+
+    await run_watcher(
+        HTTPRouteWatcher,
+        registry,
+        monkeypatch,
+        [{"type": "DELETED", "object": route.model_dump()}],
+    )
+    assert len(registry.records()) == 0
+
+
+def lb_service(name: str, ip: str) -> kubernetes.client.V1Service:
+    return kubernetes.client.V1Service(
+        metadata=kubernetes.client.V1ObjectMeta(name=name, namespace="istio-system"),
+        spec=kubernetes.client.V1ServiceSpec(
+            type="LoadBalancer", selector={"istio": "ingressgateway"}
+        ),
+        status=kubernetes.client.V1ServiceStatus(
+            load_balancer=kubernetes.client.V1LoadBalancerStatus(
+                ingress=[kubernetes.client.V1LoadBalancerIngress(ip=ip)]
+            )
+        ),
+    )
+
+
+@pytest.mark.asyncio
+async def test_virtualservice_resolves_from_cache(registry, monkeypatch):
+    """
+    This test verifies that VirtualServices are resolved from the cached Istio Gateways and
+    LoadBalancer Services, and are re-resolved when the Service exposing their Gateway changes
+    """
+    cache = IstioCache()
+    istio_gateway = {
+        "metadata": {"name": "ingress", "namespace": "istio-system"},
+        "spec": {"selector": {"istio": "ingressgateway"}},
+    }
+    virtualservice = {
+        "metadata": {"name": "app", "namespace": "app"},
+        "spec": {"gateways": ["mesh", "istio-system/ingress"], "hosts": ["app.local"]},
+    }
+    await run_watcher(
+        VirtualServiceWatcher,
+        registry,
+        monkeypatch,
+        [{"type": "ADDED", "object": virtualservice}],
+        cache,
+    )
+    assert len(registry.records()) == 0
+
+    await run_watcher(
+        IstioGatewayWatcher,
+        registry,
+        monkeypatch,
+        [{"type": "ADDED", "object": istio_gateway}],
+        cache,
+    )
+    await run_watcher(
+        LoadBalancerServiceWatcher,
+        registry,
+        monkeypatch,
+        [{"type": "ADDED", "object": lb_service("ingress", "172.18.0.2")}],
+        cache,
+    )
+    assert {r.ip_address for r in registry.records()} == {"172.18.0.2"}
+    await run_watcher(
+        LoadBalancerServiceWatcher,
+        registry,
+        monkeypatch,
+        [{"type": "MODIFIED", "object": lb_service("ingress", "172.18.0.3")}],
+        cache,
+    )
+    assert {r.ip_address for r in registry.records()} == {"172.18.0.3"}
+    await run_watcher(
+        LoadBalancerServiceWatcher,
+        registry,
+        monkeypatch,
+        [{"type": "DELETED", "object": lb_service("ingress", "172.18.0.3")}],
+        cache,
+    )
+    assert len(registry.records()) == 0
+
+
+@pytest.mark.asyncio
+async def test_watch_resumes_from_resource_version(registry, monkeypatch, gateway):
+    """
+    This test verifies that a watch starts from the resourceVersion of the initial list,
+    follows the resourceVersion of events and bookmarks, and only relists once the
+    API server reports the resourceVersion as gone
+    """
+    listed = gateway.model_dump()
+    listed["metadata"]["resourceVersion"] = "5"
+    watcher = await run_watcher(
+        GatewayWatcher,
+        registry,
+        monkeypatch,
+        [
+            {"type": "BOOKMARK", "object": {"metadata": {"resourceVersion": "7"}}},
+            kubernetes.client.exceptions.ApiException(status=410),
+        ],
+    )
+    assert watcher._api.lists == 2
+    assert watcher._watch.streamed_from == ["1", "1"]
+    assert watcher._resource_version == "1"
+
+    watcher._api = FakeApi([listed], "6")
+    watcher._watch = FakeWatch(
+        [{"type": "BOOKMARK", "object": {"metadata": {"resourceVersion": "7"}}}],
+        watcher,
+    )
+    watcher._resource_version = None
+    watcher._should_stop = False
+    await watcher.run()
+    assert watcher._watch.streamed_from == ["6"]
+    assert watcher._resource_version == "7"
+    assert "edge/gw" in registry._gateways
+
+
+@pytest.mark.asyncio
+async def test_relist_sweeps_missing_routes(
+    registry, monkeypatch, nameserver, gateway, route
+):
+    """
+    This test verifies that HTTPRoutes deleted while the watch was down are swept once a
+    fresh list no longer contains them, and that their records are withdrawn as one change
+    """
+    await registry.add_gateway(gateway)
+    await registry.add_route(route)
+    for name in ["gone1", "gone2"]:
+        gone = route.model_copy(deep=True)
+        gone.metadata.name = name
+        gone.spec.hostnames = [f"{name}.local"]
+        await registry.add_route(gone)
+    assert len(registry.records()) == 3
+    nameserver.changes.clear()
+
+    await run_watcher(
+        HTTPRouteWatcher, registry, monkeypatch, [], items=[route.model_dump()]
+    )
+    assert {r.hostname for r in registry.records()} == {"app.local"}
+    assert set(registry._routes) == {"app/app-route"}
+    assert {r.hostname for r in nameserver.changes[-1].removed} == {
+        "gone1.local",
+        "gone2.local",
+    }
+
+
+@pytest.mark.asyncio
+async def test_namespaced_watch_filters_on_server(
+    registry, monkeypatch, gateway, route
+):
+    """
+    This test verifies that a watcher scoped to a namespace lists and watches within that
+    namespace with our selectors, and only sweeps the HTTPRoutes of its own namespace
+    """
+    await registry.add_gateway(gateway)
+    other = route.model_copy(deep=True)
+    other.metadata.namespace = "other"
+    other.spec.parentRefs[0].namespace = "edge"
+    await registry.add_route(other)
+    watcher = await run_watcher(
+        HTTPRouteWatcher,
+        registry,
+        monkeypatch,
+        [],
+        items=[route.model_dump()],
+        namespace="app",
+        exclude_namespaces=["kube-system"],
+        label_selector="dns=mdns",
+    )
+    assert watcher._api.calls[0] == (
+        "list_namespaced_custom_object",
+        ("gateway.networking.k8s.io", "v1", "app", "httproutes"),
+        {
+            "field_selector": "metadata.namespace!=kube-system",
+            "label_selector": "dns=mdns",
+        },
+    )
+    assert set(registry._routes) == {"app/app-route", "other/app-route"}
+
+
+def test_parsing_drops_extra_fields(route):
+    """
+    This test verifies that parsing a resource keeps only the fields we need, dropping the
+    rest such as its managedFields and the rules of a HTTPRoute
+    """
+    obj = route.model_dump()
+    obj["metadata"]["resourceVersion"] = "5"
+    obj["metadata"]["managedFields"] = [{"manager": "kubectl", "fieldsV1": {}}]
+    obj["spec"]["rules"] = [{"backendRefs": [{"name": "app", "port": 8080}]}]
+    parsed = HTTPRoute.model_validate(obj)
+    assert parsed.metadata.resourceVersion == "5"
+    assert parsed.spec.hostnames == ["app.local"]
+    assert parsed.model_extra is None
+    assert "managedFields" not in parsed.metadata.model_dump()
+    assert "rules" not in parsed.spec.model_dump()
+
+
+class FlakyWatcher(BaseWatcher):
+    """
+    Remembers the names it handles and fails to handle those starting with "bad"
+    """
+
+    kind = "flakes"
+
+    def __init__(self, registry, **kwargs) -> None:
+        super().__init__(registry, **kwargs)
+        self.handled: typing.List[str] = []
+
+    def list_call(self):
+        return self._api.list_flakes, (), {}
+
+    async def handle(self, event_type: str, obj: typing.Any):
+        if obj["metadata"]["name"].startswith("bad"):
+            raise ValueError(f"Cannot handle {obj['metadata']['name']}")
+        self.handled.append(obj["metadata"]["name"])
+
+
+def flake(name: str, event_type: str = "ADDED") -> typing.Dict:
+    return {"type": event_type, "object": {"metadata": {"name": name}}}
+
+
+@pytest.mark.asyncio
+async def test_failing_handler_does_not_end_stream(registry, monkeypatch):
+    """
+    This test verifies that an event the watcher fails to handle is counted and skipped
+    while the events following it are still handled on the same stream
+    """
+    watcher = await run_watcher(
+        FlakyWatcher,
+        registry,
+        monkeypatch,
+        [flake("first"), flake("bad"), flake("second")],
+    )
+    assert watcher.handled == ["first", "second"]
+    assert watcher.failed_events == 1
+    assert watcher._watch.streamed_from == ["1"]
+    assert watcher.status()["failed_events"] == 1
+
+
+@pytest.mark.asyncio
+async def test_failing_stream_restarts_with_backoff(registry, monkeypatch):
+    """
+    This test verifies that a stream failing to connect is restarted with exponentially
+    growing delays capped at the maximum backoff, rather than ending the watcher
+    """
+    delays: typing.List[float] = []
+    sleep = asyncio.sleep
+
+    async def record_sleep(delay: float):
+        delays.append(delay)
+        await sleep(0)
+
+    monkeypatch.setattr(base.random, "uniform", lambda low, high: high)
+    monkeypatch.setattr(base.asyncio, "sleep", record_sleep)
+    watcher = FlakyWatcher(registry)
+    watcher.backoff_min, watcher.backoff_max = 1, 8
+    watcher._api = FakeApi([], "1")
+    watcher._watch = FakeWatch(
+        [aiohttp.ClientError("Connection refused")] * 5 + [flake("first")], watcher
+    )
+    await watcher.run()
+    assert delays == [1, 2, 4, 8, 8, 8]
+    assert watcher.restarts == 6
+    assert watcher.handled == ["first"]
+
+
+class SlowWatcher(FlakyWatcher):
+    """
+    Holds up the first event of the slow resource until the fast resource has been handled
+    """
+
+    def __init__(self, registry, slow: str, fast: str, **kwargs) -> None:
+        super().__init__(registry, **kwargs)
+        self.slow = slow
+        self.fast = fast
+        self._fast_handled = asyncio.Event()
+
+    async def handle(self, event_type: str, obj: typing.Any):
+        name = obj["metadata"]["name"]
+        if name == self.slow and event_type == "ADDED":
+            await asyncio.wait_for(self._fast_handled.wait(), timeout=1)
+        self.handled.append(f"{event_type} {name}")
+        if name == self.fast:
+            self._fast_handled.set()
+
+
+@pytest.mark.asyncio
+async def test_slow_event_does_not_hold_up_other_resources(registry, monkeypatch):
+    """
+    This test verifies that the events of a resource are handled in order while a slow event
+    does not hold up the events of resources handled by other workers
+    """
+    names = [f"app{i}" for i in range(10)]
+    slow = names[0]
+
+    def shard(name: str) -> int:
+        return hash(BaseWatcher._resource_id(flake(name)["object"])) % 2
+
+    fast = next(name for name in names if shard(name) != shard(slow))
+    watcher = await run_watcher(
+        SlowWatcher,
+        registry,
+        monkeypatch,
+        [flake(slow), flake(slow, "MODIFIED"), flake(fast)],
+        slow,
+        fast,
+        workers=2,
+    )
+    assert watcher.handled == [f"ADDED {fast}", f"ADDED {slow}", f"MODIFIED {slow}"]
+    assert watcher.failed_events == 0
+    assert watcher.queue_depth == 0
+    assert watcher.status()["processing_lag"] > 0